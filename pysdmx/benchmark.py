@@ -0,0 +1,664 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Benchmarks of pysdmx over synthetic SDMX-ML messages
+
+Runs every parser class, query_rest and data_extraction end to end
+against a local stand-in for the SDMX REST endpoint and reports
+throughput, latency percentiles and peak Python heap.  Reports written
+with --output can be compared across commits with --compare.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import http.server
+import concurrent.futures
+import urllib.parse
+
+import pysdmx
+
+MESSAGE = 'http://www.SDMX.org/resources/SDMXML/schemas/v2_0/message'
+STRUCTURE = 'http://www.SDMX.org/resources/SDMXML/schemas/v2_0/structure'
+GENERIC = 'http://www.SDMX.org/resources/SDMXML/schemas/v2_0/generic'
+COMPACT = ('urn:sdmx:org.sdmx.infomodel.keyfamily.KeyFamily='
+        'ECB:ECB_EXR1:compact')
+
+HEADER = ('<message:Header><message:ID>BENCHMARK</message:ID>'
+        '<message:Test>true</message:Test></message:Header>')
+
+# SDMX-ML period of observation i for every frequency
+PERIODS = {
+        'A': lambda i: '%04d' % (1900 + i),
+        'S': lambda i: '%04d-S%d' % (1900 + i // 2, i % 2 + 1),
+        'Q': lambda i: '%04d-Q%d' % (1900 + i // 4, i % 4 + 1),
+        'M': lambda i: '%04d-%02d' % (1900 + i // 12, i % 12 + 1),
+        'W': lambda i: '%04d-W%02d' % (1900 + i // 52, i % 52 + 1),
+        'D': lambda i: '%04d-%02d-%02d' % (1900 + i // 336,
+            i // 28 % 12 + 1, i % 28 + 1),
+        }
+
+
+def structure_message(body):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<message:Structure xmlns:message="%s" xmlns:structure="%s">'
+            '%s%s</message:Structure>'
+            % (MESSAGE, STRUCTURE, HEADER, body)).encode('utf-8')
+
+
+def codelist_message(codelists=20, codes=500):
+    body = ['<message:CodeLists>']
+    for i in range(codelists):
+        body.append('<structure:CodeList id="CL_%d" agencyID="ECB" '
+                'version="1.0"><structure:Name xml:lang="en">Code list %d'
+                '</structure:Name>' % (i, i))
+        for j in range(codes):
+            body.append('<structure:Code value="C%d"><structure:Description '
+                    'xml:lang="en">Code %d of list %d</structure:Description>'
+                    '</structure:Code>' % (j, j, i))
+        body.append('</structure:CodeList>')
+    body.append('</message:CodeLists>')
+    return structure_message(''.join(body))
+
+
+def dataflow_message(dataflows=1000):
+    body = ['<message:Dataflows>']
+    for i in range(dataflows):
+        body.append('<structure:Dataflow id="DF%d" agencyID="ECB" '
+                'version="1.0"><structure:Name xml:lang="en">Dataflow %d'
+                '</structure:Name><structure:KeyFamilyRef>'
+                '<structure:KeyFamilyID>ECB_EXR1</structure:KeyFamilyID>'
+                '<structure:KeyFamilyAgencyID>ECB'
+                '</structure:KeyFamilyAgencyID></structure:KeyFamilyRef>'
+                '<structure:CategoryRef><structure:CategorySchemeID>SDW'
+                '</structure:CategorySchemeID><structure:CategoryID>'
+                '<structure:ID>%d</structure:ID></structure:CategoryID>'
+                '</structure:CategoryRef></structure:Dataflow>'
+                % (i, i, i % 50))
+    body.append('</message:Dataflows>')
+    return structure_message(''.join(body))
+
+
+def categoryscheme_message(categories=1000):
+    body = ['<message:CategorySchemes><structure:CategoryScheme id="SDW" '
+            'agencyID="ECB" version="1.0"><structure:Name xml:lang="en">'
+            'Statistical data warehouse</structure:Name>']
+    for i in range(categories):
+        body.append('<structure:Category id="%d"><structure:Name '
+                'xml:lang="en">Category %d</structure:Name>'
+                '<structure:DataflowRef><structure:AgencyID>ECB'
+                '</structure:AgencyID><structure:DataflowID>DF%d'
+                '</structure:DataflowID><structure:Version>1.0'
+                '</structure:Version></structure:DataflowRef>'
+                '</structure:Category>' % (i, i, i))
+    body.append('</structure:CategoryScheme></message:CategorySchemes>')
+    return structure_message(''.join(body))
+
+
+def concept_message(concepts=1000):
+    body = ['<message:Concepts>']
+    for i in range(concepts):
+        body.append('<structure:Concept id="CONCEPT_%d" agencyID="ECB" '
+                'version="1.0"><structure:Name xml:lang="en">Concept %d'
+                '</structure:Name></structure:Concept>' % (i, i))
+    body.append('</message:Concepts>')
+    return structure_message(''.join(body))
+
+
+def organisationscheme_message(agencies=1000):
+    body = ['<message:OrganisationSchemes><structure:OrganisationScheme '
+            'id="AGENCIES" agencyID="SDMX" version="1.0"><structure:Name '
+            'xml:lang="en">Agencies</structure:Name><structure:Agencies>']
+    for i in range(agencies):
+        body.append('<structure:Agency id="A%d"><structure:Name '
+                'xml:lang="en">Agency %d</structure:Name></structure:Agency>'
+                % (i, i))
+    body.append('</structure:Agencies></structure:OrganisationScheme>'
+            '</message:OrganisationSchemes>')
+    return structure_message(''.join(body))
+
+
+def keyfamily_message(codes=500):
+    dimensions = [('FREQ', 'CL_FREQ', list(PERIODS)),
+            ('CURRENCY', 'CL_CURRENCY',
+                ['C%04d' % i for i in range(codes)] + ['EUR']),
+            ('CURRENCY_DENOM', 'CL_CURRENCY', ['EUR'])]
+    body = ['<message:CodeLists>']
+    for name, codelist, values in dimensions[:2] + [
+            ('OBS_STATUS', 'CL_OBS_STATUS', ['A', 'E'])]:
+        body.append('<structure:CodeList id="%s" agencyID="ECB" '
+                'version="1.0"><structure:Name xml:lang="en">%s'
+                '</structure:Name>' % (codelist, codelist))
+        for value in values:
+            body.append('<structure:Code value="%s"><structure:Description '
+                    'xml:lang="en">%s %s</structure:Description>'
+                    '</structure:Code>' % (value, name, value))
+        body.append('</structure:CodeList>')
+    body.append('</message:CodeLists><message:KeyFamilies>'
+            '<structure:KeyFamily id="ECB_EXR1" agencyID="ECB" '
+            'version="1.0"><structure:Name xml:lang="en">Exchange rates'
+            '</structure:Name><structure:Components>')
+    for name, codelist, _ in dimensions:
+        body.append('<structure:Dimension conceptRef="%s" codelist="%s"/>'
+                % (name, codelist))
+    body.append('<structure:TimeDimension conceptRef="TIME_PERIOD"/>'
+            '<structure:PrimaryMeasure conceptRef="OBS_VALUE"/>'
+            '<structure:Attribute conceptRef="OBS_STATUS" '
+            'codelist="CL_OBS_STATUS" attachmentLevel="Observation"/>'
+            '<structure:Attribute conceptRef="OBS_CONF" '
+            'attachmentLevel="Observation"/>'
+            '<structure:Attribute conceptRef="TITLE" '
+            'attachmentLevel="Series"/>'
+            '</structure:Components></structure:KeyFamily>'
+            '</message:KeyFamilies>')
+    return structure_message(''.join(body))
+
+
+def generic_message(series=1000, observations=100, frequencies='M'):
+    body = ['<?xml version="1.0" encoding="UTF-8"?>'
+            '<message:GenericData xmlns:message="%s" xmlns:generic="%s">'
+            '%s<message:DataSet><generic:KeyFamilyRef>ECB_EXR1'
+            '</generic:KeyFamilyRef>' % (MESSAGE, GENERIC, HEADER)]
+    for i in range(series):
+        frequency = frequencies[i % len(frequencies)]
+        body.append('<generic:Series><generic:SeriesKey>'
+                '<generic:Value concept="FREQ" value="%s"/>'
+                '<generic:Value concept="CURRENCY" value="C%04d"/>'
+                '<generic:Value concept="CURRENCY_DENOM" value="EUR"/>'
+                '</generic:SeriesKey><generic:Attributes>'
+                '<generic:Value concept="TITLE" value="Series %d"/>'
+                '</generic:Attributes>' % (frequency, i, i))
+        for j in range(observations):
+            body.append('<generic:Obs><generic:Time>%s</generic:Time>'
+                    '<generic:ObsValue value="%.4f"/><generic:Attributes>'
+                    '<generic:Value concept="OBS_STATUS" value="%s"/>'
+                    '<generic:Value concept="OBS_CONF" value="F"/>'
+                    '</generic:Attributes></generic:Obs>'
+                    % (PERIODS[frequency](j), 1 + j / 1000.,
+                        'E' if j % 10 == 0 else 'A'))
+        body.append('</generic:Series>')
+    body.append('</message:DataSet></message:GenericData>')
+    return ''.join(body).encode('utf-8')
+
+
+def compact_message(series=1000, observations=100, frequencies='M',
+        structure_specific=False):
+    # CompactData (2.0) qualifies Series and Obs with the key family
+    # namespace, StructureSpecificData (2.1) leaves them unqualified
+    if structure_specific:
+        root = ('<message:StructureSpecificData xmlns:message="%s">%s'
+                '<message:DataSet>' % (MESSAGE, HEADER))
+        tail = '</message:DataSet></message:StructureSpecificData>'
+        prefix = ''
+    else:
+        root = ('<message:CompactData xmlns:message="%s" xmlns:exr="%s">%s'
+                '<exr:DataSet>' % (MESSAGE, COMPACT, HEADER))
+        tail = '</exr:DataSet></message:CompactData>'
+        prefix = 'exr:'
+    body = ['<?xml version="1.0" encoding="UTF-8"?>', root]
+    for i in range(series):
+        frequency = frequencies[i % len(frequencies)]
+        body.append('<%sSeries FREQ="%s" CURRENCY="C%04d" '
+                'CURRENCY_DENOM="EUR" TITLE="Series %d">'
+                % (prefix, frequency, i, i))
+        for j in range(observations):
+            body.append('<%sObs TIME_PERIOD="%s" OBS_VALUE="%.4f" '
+                    'OBS_STATUS="%s" OBS_CONF="F"/>' % (prefix,
+                        PERIODS[frequency](j), 1 + j / 1000.,
+                        'E' if j % 10 == 0 else 'A'))
+        body.append('</%sSeries>' % prefix)
+    body.append(tail)
+    return ''.join(body).encode('utf-8')
+
+
+def csv_message(series=1000, observations=100, frequencies='M'):
+    body = ['DATAFLOW,FREQ,CURRENCY,CURRENCY_DENOM,TIME_PERIOD,OBS_VALUE,'
+            'OBS_STATUS,OBS_CONF,TITLE']
+    for i in range(series):
+        frequency = frequencies[i % len(frequencies)]
+        for j in range(observations):
+            body.append('ECB:EXR(1.0),%s,C%04d,EUR,%s,%.4f,%s,F,Series %d'
+                    % (frequency, i, PERIODS[frequency](j), 1 + j / 1000.,
+                        'E' if j % 10 == 0 else 'A', i))
+    return ('\n'.join(body) + '\n').encode('utf-8')
+
+
+def json_message(series=1000, observations=100, frequencies='M'):
+    # SDMX-JSON 1.0, periods of all frequencies share the observation
+    # dimension
+    used = sorted(set(frequencies), key=frequencies.index)
+    periods = [PERIODS[frequency](j) for frequency in used
+            for j in range(observations)]
+    values = {}
+    for i in range(series):
+        frequency = frequencies[i % len(frequencies)]
+        first = used.index(frequency) * observations
+        values['%d:%d:0' % (used.index(frequency), i)] = {
+                'attributes': [i],
+                'observations': dict((str(first + j),
+                    [round(1 + j / 1000., 4), 1 if j % 10 == 0 else 0, 0])
+                    for j in range(observations)),
+                }
+
+    def dimension(id, codes):
+        return {'id': id, 'values': [{'id': code} for code in codes]}
+
+    return json.dumps({
+        'header': {'id': 'BENCHMARK'},
+        'dataSets': [{'action': 'Information', 'series': values}],
+        'structure': {
+            'dimensions': {
+                'series': [dimension('FREQ', used),
+                    dimension('CURRENCY',
+                        ['C%04d' % i for i in range(series)]),
+                    dimension('CURRENCY_DENOM', ['EUR'])],
+                'observation': [dimension('TIME_PERIOD', periods)],
+                },
+            'attributes': {
+                'series': [dimension('TITLE',
+                    ['Series %d' % i for i in range(series)])],
+                'observation': [dimension('OBS_STATUS', ['A', 'E']),
+                    dimension('OBS_CONF', ['F'])],
+                },
+            },
+        }).encode('utf-8')
+
+
+_components = []
+
+
+def components():
+    # key family of the synthetic data messages
+    if not _components:
+        _components.append(pysdmx.Keyfamily(pysdmx.parse_xml(
+            keyfamily_message())).components['ECB_EXR1'])
+    return _components[0]
+
+
+class StandInServer(object):
+    # local stand-in for an SDMX REST endpoint serving synthetic messages
+    # by resource, gzip-compressed when the client asks for it
+    def __init__(self, series=1000, observations=100, frequencies='M',
+            structures=1000):
+        self.messages = {
+                'GenericData': generic_message(series, observations,
+                    frequencies),
+                'CompactData': compact_message(series, observations,
+                    frequencies),
+                'StructureSpecificData': compact_message(series,
+                    observations, frequencies, structure_specific=True),
+                'CodeList': codelist_message(20, structures // 2),
+                'KeyFamily': keyfamily_message(structures // 2),
+                'Dataflow': dataflow_message(structures),
+                'CategoryScheme': categoryscheme_message(structures),
+                'Concept': concept_message(structures),
+                'OrganisationScheme': organisationscheme_message(structures),
+                }
+        # GenericData as SDMX-CSV and SDMX-JSON, by the Accept header
+        self.media = {
+                'text/csv': csv_message(series, observations, frequencies),
+                'application/json': json_message(series, observations,
+                    frequencies),
+                }
+        self.compressed = dict((resource, gzip.compress(message, 1))
+                for resource, message in list(self.messages.items())
+                + list(self.media.items()))
+        self.requests = 0
+        # paths and queries asked for, in order
+        self.paths = []
+        # answers whose body is cut off halfway, as by a connection reset
+        self.cuts = 0
+        # whole bodies sent chunked, without a Content-Length
+        self.chunked = False
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._server.server_address[:2]
+
+    def start(self):
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body go out as separate writes
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in.requests += 1
+                stand_in.paths.append(self.path)
+                path = urllib.parse.urlparse(self.path).path
+                resource = path.strip('/').split('/')[0]
+                if resource not in stand_in.messages:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                accept = self.headers.get('Accept', '')
+                content_type = 'text/xml'
+                if resource == 'GenericData':
+                    if 'data+csv' in accept:
+                        content_type = 'text/csv'
+                    elif 'data+json' in accept:
+                        content_type = 'application/json'
+                if content_type in stand_in.media:
+                    resource = content_type
+                    body = stand_in.media[content_type]
+                else:
+                    body = stand_in.messages[resource]
+                # the same tag whatever the coding, for revalidation
+                etag = '"%08x"' % zlib.crc32(body)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                encoding = None
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = stand_in.compressed[resource]
+                    encoding = 'gzip'
+                # byte ranges of the coded body, as for resumed downloads
+                start = 0
+                ranged = self.headers.get('Range', '')
+                if ranged.startswith('bytes=') and ranged.endswith('-'):
+                    start = int(ranged[6:-1])
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header('Content-Range',
+                                'bytes */%d' % len(body))
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                        start, len(body) - 1, len(body)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', etag)
+                if encoding is not None:
+                    self.send_header('Content-Encoding', encoding)
+                body = body[start:]
+                if stand_in.chunked and not start:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    body = b''.join(b'%x\r\n%s\r\n' % (len(chunk), chunk)
+                            for chunk in (body[i:i + 256]
+                                for i in range(0, len(body), 256))
+                            ) + b'0\r\n\r\n'
+                else:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if stand_in.cuts:
+                    stand_in.cuts -= 1
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def measure(function, repeat=5, size=None, items=None):
+    # latency of every run, then one more run under tracemalloc for the
+    # peak Python heap (libxml2 allocates outside of it)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {
+            'samples': samples,
+            'p50': percentile(samples, 0.5),
+            'p90': percentile(samples, 0.9),
+            'p99': percentile(samples, 0.99),
+            'best': min(samples),
+            'peak_memory': peak,
+            }
+    if size is not None:
+        result['bytes'] = size
+        result['mb_per_s'] = size / result['p50'] / 2 ** 20
+    if items is not None:
+        result['items'] = items
+        result['items_per_s'] = items / result['p50']
+    return result
+
+
+PARSERS = [
+        ('Codelist.codes', 'CodeList',
+            lambda tree: pysdmx.Codelist(tree).codes),
+        ('Codelist.index', 'CodeList',
+            lambda tree: pysdmx.Codelist(tree).index),
+        ('Keyfamily.codes', 'KeyFamily',
+            lambda tree: pysdmx.Keyfamily(tree).codes),
+        ('Dataflows.all_dataflows', 'Dataflow',
+            lambda tree: pysdmx.Dataflows(tree).all_dataflows),
+        ('Categoryscheme.codes', 'CategoryScheme',
+            lambda tree: pysdmx.Categoryscheme(tree).codes),
+        ('Concept.conceptdata', 'Concept',
+            lambda tree: pysdmx.Concept(tree).conceptdata),
+        ('Organisationschemes.codes', 'OrganisationScheme',
+            lambda tree: pysdmx.Organisationschemes(tree).codes),
+        ('Data.time_series', 'GenericData',
+            lambda tree: pysdmx.Data(tree).time_series),
+        ('Data.to_frame', 'GenericData',
+            lambda tree: pysdmx.Data(tree).to_frame()),
+        ('Data.keys', 'GenericData', lambda tree: pysdmx.Data(tree).keys()),
+        ('Data[key]', 'GenericData',
+            lambda tree: pysdmx.Data(tree)['M.C0000.EUR']),
+        ('Data.select', 'GenericData',
+            lambda tree: pysdmx.Data(tree).select(
+                CURRENCY=['C0000', 'C0001']).to_frame()),
+        ('CompactData.time_series', 'CompactData',
+            lambda tree: pysdmx.CompactData(tree,
+                components()).time_series),
+        ('StructureSpecificData.time_series', 'StructureSpecificData',
+            lambda tree: pysdmx.CompactData(tree,
+                components()).time_series),
+        ]
+
+
+def run(series=1000, observations=100, frequencies='M', structures=1000,
+        repeat=5, cases=None):
+    results = {}
+
+    def selected(name):
+        return cases is None or any(case in name for case in cases)
+
+    # fresh interpreters, the bare one giving the startup to subtract
+    for name, statement in (('import/python', 'pass'),
+            ('import/pysdmx', 'import pysdmx'),
+            ('import/pysdmx.ECB', 'import pysdmx; pysdmx.ECB'),
+            ('import/pysdmx+dependencies', 'import pysdmx, requests, '
+                'pandas, numpy, lxml.etree')):
+        if selected(name):
+            results[name] = measure(lambda: subprocess.check_call(
+                [sys.executable, '-c', statement],
+                cwd=os.path.dirname(os.path.abspath(__file__))), repeat)
+    with StandInServer(series, observations, frequencies,
+            structures) as server:
+        messages = server.messages
+        observations_total = series * observations
+        for resource, message in sorted(messages.items()):
+            name = 'parse_xml/' + resource
+            if selected(name):
+                results[name] = measure(
+                        lambda: pysdmx.parse_xml(message), repeat,
+                        size=len(message))
+        for name, resource, parse in PARSERS:
+            if not selected(name):
+                continue
+            tree = pysdmx.parse_xml(messages[resource])
+            results[name] = measure(lambda: parse(tree), repeat,
+                    size=len(messages[resource]),
+                    items=observations_total if resource.endswith('Data')
+                    else None)
+        for name, content_type, read in (
+                ('Data.from_csv', 'text/csv', pysdmx.Data.from_csv),
+                ('Data.from_json', 'application/json',
+                    pysdmx.Data.from_json)):
+            if selected(name):
+                message = server.media[content_type]
+                results[name] = measure(lambda: read(message).time_series,
+                        repeat, size=len(message), items=observations_total)
+        transport = pysdmx.Transport()
+        for resource in sorted(messages):
+            name = 'query_rest/' + resource
+            if selected(name):
+                url = server.url + '/' + resource
+                results[name] = measure(
+                        lambda: pysdmx.query_rest(url, transport=transport),
+                        repeat, size=len(messages[resource]))
+        client = pysdmx.SDMX_REST(server.url, 'ECB', transport=transport)
+        keyfamily = pysdmx.Keyfamily(pysdmx.parse_xml(
+            messages['KeyFamily']))
+        for name, stream, format_, resource in (
+                ('data_extraction/tree', False, 'generic', 'GenericData'),
+                ('data_extraction/stream', True, 'generic', 'GenericData'),
+                ('data_extraction/compact', False, 'compact',
+                    'CompactData'),
+                ('data_extraction/structurespecific', False,
+                    'structurespecific', 'StructureSpecificData'),
+                ('data_extraction/csv', False, 'csv', 'text/csv'),
+                ('data_extraction/json', False, 'json',
+                    'application/json')):
+            if selected(name):
+                size = len(messages[resource] if resource in messages
+                        else server.media[resource])
+                results[name] = measure(lambda: client.data_extraction(
+                    'EXR', None, None, stream=stream, format=format_,
+                    keyfamily=keyfamily).time_series, repeat,
+                    size=size, items=observations_total)
+        if selected('data_download'):
+            # the whole flow through a file on disk, parsed as it is read
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'EXR.xml')
+                results['data_download'] = measure(
+                        lambda: client.data_download('EXR', path).time_series,
+                        repeat, size=len(messages['GenericData']),
+                        items=observations_total)
+        if selected('ResultCache'):
+            # a fresh client, as many threads asking for the same key
+            # family at once
+            def keyfamilies():
+                client_ = pysdmx.SDMX_REST(server.url, 'ECB',
+                        transport=transport, max_connections=16)
+                with concurrent.futures.ThreadPoolExecutor(16) as executor:
+                    list(executor.map(lambda _: client_.data_keyfamily('EXR'),
+                        range(64)))
+            results['ResultCache/64 data_keyfamily'] = measure(keyfamilies,
+                    repeat)
+        if selected('StructureRegistry'):
+            results['StructureRegistry.fetch'] = measure(
+                    lambda: pysdmx.StructureRegistry.fetch(client), repeat)
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'registry.pickle')
+                pysdmx.StructureRegistry.fetch(client).save(path)
+                results['StructureRegistry.load'] = measure(
+                        lambda: pysdmx.StructureRegistry.load(path), repeat,
+                        size=os.path.getsize(path))
+        transport.close()
+    return results
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    print('%-36s %9s %9s %9s %9s %10s %8s' % ('case', 'p50 ms', 'p90 ms',
+        'p99 ms', 'MB/s', 'peak MB', 'vs base'))
+    for name, result in sorted(results.items()):
+        change = ''
+        if baseline is not None and name in baseline['results']:
+            change = '%7.2fx' % (baseline['results'][name]['p50']
+                    / result['p50'])
+        print('%-36s %9.1f %9.1f %9.1f %9s %10.1f %8s' % (name,
+            result['p50'] * 1000, result['p90'] * 1000,
+            result['p99'] * 1000,
+            '%.1f' % result['mb_per_s'] if 'mb_per_s' in result else '',
+            result['peak_memory'] / 2. ** 20, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--series', type=int, default=1000)
+    parser.add_argument('--observations', type=int, default=100)
+    parser.add_argument('--frequencies', default='M',
+            help='frequency codes cycled over the series, e.g. AQMD')
+    parser.add_argument('--structures', type=int, default=1000,
+            help='items per structural message')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--case', action='append', dest='cases',
+            help='only run cases whose name contains this, repeatable')
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--compare', help='JSON report to compare with')
+    arguments = parser.parse_args(argv)
+    parameters = dict((name, getattr(arguments, name)) for name in
+            ('series', 'observations', 'frequencies', 'structures',
+                'repeat'))
+    results = run(cases=arguments.cases, **parameters)
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as file_:
+            baseline = json.load(file_)
+    report(results, baseline)
+    if arguments.output:
+        with open(arguments.output, 'w') as file_:
+            json.dump({
+                'commit': commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'parameters': parameters,
+                'results': results,
+                }, file_, indent=1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
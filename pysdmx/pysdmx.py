@@ -2,158 +2,2087 @@
 # -*- coding: utf-8 -*-
 """ Python interface to SDMX """
 
-import requests
-import pandas
-import lxml.etree
-import uuid
+import os
+import re
+import sys
+import io
+import gzip
+import json
+import mmap
+import time
+import hashlib
 import datetime
-import numpy
+import threading
+import collections
+import collections.abc
+import contextlib
+import urllib.parse
+import importlib
+
+
+class _LazyModule(object):
+    # stands in for a heavy dependency until one of its attributes is
+    # used, so importing pysdmx stays cheap; attributes are then copied
+    # onto the proxy and later lookups skip __getattr__
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        try:
+            value = getattr(self._module, attribute)
+        except AttributeError:
+            # submodules such as lxml.etree
+            value = importlib.import_module(self._name + '.' + attribute)
+        setattr(self, attribute, value)
+        return value
+
+
+requests = _LazyModule('requests')
+pandas = _LazyModule('pandas')
+lxml = _LazyModule('lxml')
+numpy = _LazyModule('numpy')
+urllib3 = _LazyModule('urllib3')
+# standard modules only some features use
+concurrent = _LazyModule('concurrent')
+pickle = _LazyModule('pickle')
+zipfile = _LazyModule('zipfile')
+cProfile = _LazyModule('cProfile')
+pstats = _LazyModule('pstats')
+tracemalloc = _LazyModule('tracemalloc')
+
+# strptime formats of the SDMX-ML time periods that map to a single
+# timestamp; quarters and semesters are resolved in time_index
+TIME_FORMATS = {
+        'A': '%Y',
+        'M': '%Y-%m',
+        'D': '%Y-%m-%d',
+        'B': '%Y-%m-%d',
+        }
+
+# months per sub-annual period, the period is stamped on its last month
+PERIOD_MONTHS = {
+        'Q': 3,
+        'H': 6,
+        'S': 6,
+        }
+
+
+def time_index(dates, frequency):
+    dates = pandas.Index(dates, dtype=object)
+    if frequency in TIME_FORMATS:
+        try:
+            return pandas.DatetimeIndex(pandas.to_datetime(dates,
+                format=TIME_FORMATS[frequency]))
+        except ValueError:
+            pass
+    elif frequency in PERIOD_MONTHS:
+        parts = dates.str.extract(r'^(\d{4})-?[A-Z](\d)$')
+        if not parts.isnull().values.any():
+            return pandas.DatetimeIndex(pandas.to_datetime(pandas.DataFrame({
+                'year': parts[0].astype('int64'),
+                'month': parts[1].astype('int64') * PERIOD_MONTHS[frequency],
+                'day': 1})))
+    elif frequency == 'W':
+        try:
+            return pandas.DatetimeIndex(pandas.to_datetime(dates + '-1',
+                format='%G-W%V-%u'))
+        except ValueError:
+            pass
+    # minutely periods, hourly timestamps and providers that send plain
+    # dates for any frequency
+    return pandas.DatetimeIndex(pandas.to_datetime(dates, format='ISO8601'))
+
 
 def date_parser(date, frequency):
-    if frequency == 'A':
-        return datetime.datetime.strptime(date, '%Y')
-    if frequency == 'Q':
-        date = date.split('-Q')
-        date = str(int(date[1])*3) + date[0]
-        return datetime.datetime.strptime(date, '%m%Y')
-    if frequency == 'M':
-        return datetime.datetime.strptime(date, '%Y-%m')
+    return time_index([date], frequency)[0].to_pydatetime()
+
+
+class Transport(object):
+    # HTTP statuses worth another attempt, anything else but 200 is final
+    retry_status = (429, 500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=5, read_timeout=20, retries=3,
+            backoff=0.5, max_backoff=30, pool_size=10):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            self._session = session
+        return self._session
+
+    def _delay(self, attempt, request=None):
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        if request is not None:
+            retry_after = request.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                delay = min(float(retry_after), self.max_backoff)
+        return delay
+
+    def get(self, url, stream=False, headers=None):
+        attempt = 0
+        while True:
+            try:
+                request = self.session.get(url, stream=stream,
+                        headers=headers,
+                        timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout):
+                # without stream the body is read in get, a connection
+                # reset halfway through it is retried too
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+            else:
+                if request.status_code not in self.retry_status \
+                        or attempt >= self.retries:
+                    return request
+                request.close()
+                time.sleep(self._delay(attempt, request))
+            attempt += 1
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class Stats(object):
+    # seconds spent per phase and running counters of requests, bytes,
+    # series, observations and cache use; callbacks get every
+    # (phase, seconds) as it is recorded
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.phases = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+        for callback in self.callbacks:
+            callback(phase, seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def capture(self, mode='cprofile'):
+        # one-off deep dive: profile holds a pstats.Stats or a
+        # tracemalloc snapshot of the block afterwards
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.profile = pstats.Stats(profiler)
+        elif mode == 'tracemalloc':
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            try:
+                yield
+            finally:
+                self.profile = tracemalloc.take_snapshot()
+                self.counts['peak_memory'] = max(
+                        self.counts['peak_memory'],
+                        tracemalloc.get_traced_memory()[1])
+                if started:
+                    tracemalloc.stop()
+        else:
+            raise ValueError("Unknown capture mode({})".format(mode))
+
+    def snapshot(self):
+        with self._lock:
+            return {'phases': dict(self.phases), 'counts': dict(self.counts)}
+
+    def reset(self):
+        with self._lock:
+            self.phases.clear()
+            self.counts.clear()
+            self.profile = None
+
+
+class _NoStats(object):
+    # stands in when no Stats is given, every hook is a no-op
+    def record(self, phase, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield
+
+
+_no_stats = _NoStats()
+
+
+_transport = None
+
+
+def _wire_bytes(request):
+    # bytes read off the socket, before gzip decoding
+    try:
+        return request.raw.tell()
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+class StatusError(ValueError):
+    # a service answering with anything but 200, status_code telling why
+    def __init__(self, status_code):
+        ValueError.__init__(self, "Error getting client({})".format(
+            status_code))
+        self.status_code = status_code
+
+
+def _default_transport(transport):
+    global _transport
+    if transport is None:
+        if _transport is None:
+            _transport = Transport()
+        transport = _transport
+    return transport
+
+
+def _request(url, transport=None, stats=None, headers=None, read=None):
+    # with read, the body is taken in by read(request), whose result is
+    # given back; a connection lost halfway through it is retried as one
+    # lost before the answer came is by the transport
+    transport = _default_transport(transport)
+    attempt = 0
+    while True:
+        stats.count('requests')
+        # DNS, connect, retries and waiting for the response headers
+        with stats.phase('request'):
+            request = transport.get(url, stream=True, headers=headers)
+        if request.status_code == requests.codes.not_acceptable and headers:
+            # a server without any of the accepted formats gets asked
+            # again for its default one
+            request.close()
+            return _request(url, transport, stats, read=read)
+        if request.status_code != requests.codes.ok:
+            request.close()
+            raise StatusError(request.status_code)
+        if read is None:
+            return request
+        try:
+            return read(request)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError):
+            if attempt >= transport.retries:
+                raise
+            time.sleep(transport._delay(attempt))
+            attempt += 1
+        finally:
+            request.close()
+
+
+def _content(stats):
+    # read for _request of the whole body at once
+    def read(request):
+        with stats.phase('transfer'):
+            content = request.content
+        stats.count('bytes', len(content))
+        stats.count('wire_bytes', _wire_bytes(request))
+        return request, content
+    return read
+
+
+def query_bytes(url, transport=None, stats=None):
+    if stats is None:
+        stats = _no_stats
+    _, content = _request(url, transport, stats, read=_content(stats))
+    return content
+
+
+# media types of the SDMX 2.1 REST data formats; XML is always accepted
+# as well, with a lower preference, for servers without them
+MEDIA_TYPES = {
+        'csv': 'application/vnd.sdmx.data+csv;version=1.0.0',
+        'json': 'application/vnd.sdmx.data+json;version=1.0.0',
+        }
+
+
+def query_media(url, format, transport=None, stats=None):
+    # gives the content type the server answered with and the body
+    if stats is None:
+        stats = _no_stats
+    request, content = _request(url, transport, stats, headers={
+        'Accept': MEDIA_TYPES[format] + ', application/xml;q=0.5'},
+        read=_content(stats))
+    return request.headers.get('Content-Type', ''), content
+
+
+def query_rest(url, stream=False, transport=None, stats=None):
+    if stats is None:
+        stats = _no_stats
+    if stream:
+        request = _request(url, transport, stats)
+        # hand the raw socket body to iterparse, chunk by chunk, gzip-decoded
+        # on the way as its Content-Encoding asks; unlike the body read
+        # here, a connection lost while the stream is read is not retried
+        request.raw.decode_content = True
+        return request.raw
+
+    # body chunks go straight into the parser as they arrive, so the tree
+    # is built while the download runs and no copy of the whole body or
+    # of a decoded string is ever made; a retried body starts a new tree
+    def read(request):
+        parser = _xml_parser()
+        size = 0
+        feeding = 0.
+        started = time.perf_counter()
+        try:
+            for chunk in request.iter_content(chunk_size=CHUNK_SIZE):
+                size += len(chunk)
+                fed = time.perf_counter()
+                parser.feed(chunk)
+                feeding += time.perf_counter() - fed
+            fed = time.perf_counter()
+            tree = parser.close()
+            feeding += time.perf_counter() - fed
+        finally:
+            stats.record('transfer', time.perf_counter() - started - feeding)
+            stats.record('tree', feeding)
+            stats.count('wire_bytes', _wire_bytes(request))
+        stats.count('bytes', size)
+        return tree
+
+    return _request(url, transport, stats, read=read)
+
+
+# bytes read from the socket per parser feed
+CHUNK_SIZE = 64 * 1024
+
+
+def _content_range(request):
+    # first byte and total size of a 206 answer, the total None if unknown
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)',
+            request.headers.get('Content-Range', ''))
+    if match is None:
+        raise ValueError("Invalid Content-Range({})".format(
+            request.headers.get('Content-Range')))
+    start, total = match.groups()
+    return int(start), None if total == '*' else int(total)
+
+
+def download(url, path, transport=None, stats=None, progress=None,
+        restart=True):
+    # stream the body of url to path through path + '.part', as it comes
+    # off the wire (gzip when the server compresses it, which open_source
+    # reads), calling progress(done, total) after every chunk. A transfer
+    # that breaks off is resumed from the bytes on disk with a Range
+    # request, by a later call as well, where the server accepts ranges;
+    # otherwise it starts over, or gives False when not restart
+    if stats is None:
+        stats = _no_stats
+    transport = _default_transport(transport)
+    part = path + '.part'
+    try:
+        with open(part + '.json') as meta:
+            entry = json.load(meta)
+    except (OSError, ValueError):
+        entry = None
+    if entry is None or entry.get('url') != url \
+            or not os.path.exists(part):
+        entry = {'url': url}
+        open(part, 'wb').close()
+    failures = 0
+    while True:
+        done = os.path.getsize(part)
+        # a single coding so that ranges of the stored bytes line up
+        headers = {'Accept-Encoding': 'gzip'}
+        if done:
+            headers['Range'] = 'bytes={}-'.format(done)
+            # the rest only when the body is still the same one
+            validator = entry.get('etag') or entry.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        stats.count('requests')
+        with stats.phase('request'):
+            request = transport.get(url, stream=True, headers=headers)
+        try:
+            if request.status_code == requests.codes.range_not_satisfiable \
+                    and done == entry.get('total'):
+                break
+            if request.status_code in (requests.codes.partial_content,
+                    requests.codes.range_not_satisfiable):
+                start, total = (_content_range(request)
+                        if request.status_code
+                        == requests.codes.partial_content else (None, None))
+                if start != done or entry.get('total') not in (None, total):
+                    # some other body than the one on disk, start over
+                    os.remove(part + '.json')
+                    entry = {'url': url}
+                    open(part, 'wb').close()
+                    continue
+                if entry.get('total') is None:
+                    # a first answer of unknown size, the 206 tells it
+                    entry['total'] = total
+                    with open(part + '.json', 'w') as meta:
+                        json.dump(entry, meta)
+                stats.count('download_resumes')
+            elif request.status_code == requests.codes.ok:
+                if done:
+                    stats.count('download_restarts')
+                total = request.headers.get('Content-Length')
+                entry = {
+                    'url': url,
+                    'etag': request.headers.get('ETag'),
+                    'last_modified': request.headers.get('Last-Modified'),
+                    'total': int(total) if total is not None else None,
+                    'ranges': request.headers.get('Accept-Ranges') == 'bytes',
+                    }
+                with open(part + '.json', 'w') as meta:
+                    json.dump(entry, meta)
+                done = 0
+            else:
+                raise StatusError(request.status_code)
+            try:
+                with open(part, 'ab' if done else 'wb') as file_, \
+                        stats.phase('transfer'):
+                    for chunk in request.raw.stream(CHUNK_SIZE,
+                            decode_content=False):
+                        file_.write(chunk)
+                        done += len(chunk)
+                        failures = 0
+                        stats.count('wire_bytes', len(chunk))
+                        if progress is not None:
+                            progress(done, entry['total'])
+            except urllib3.exceptions.HTTPError as error:
+                if failures >= transport.retries:
+                    # as requests does for the bodies it reads itself
+                    raise requests.exceptions.ConnectionError(error)
+            else:
+                if entry['total'] is None or done >= entry['total']:
+                    break
+                if failures >= transport.retries:
+                    raise ValueError("Incomplete download({})".format(url))
+            # broken off, the next round asks for the rest
+            if not entry['ranges'] and not restart:
+                os.remove(part)
+                os.remove(part + '.json')
+                return False
+            time.sleep(transport._delay(failures))
+            failures += 1
+        finally:
+            request.close()
+    os.replace(part, path)
+    try:
+        os.remove(part + '.json')
+    except OSError:
+        pass
+    return True
+
+
+def _xml_parser():
+    # the document encoding comes from its XML declaration
+    return lxml.etree.XMLParser(ns_clean=True, recover=True)
+
+
+def parse_xml(content):
+    return lxml.etree.fromstring(content, parser=_xml_parser())
+
+
+class _Closing(object):
+    # a decompressing stream that also closes the archive and the file
+    # it reads from, which it leaves open itself
+    def __init__(self, stream, *owners):
+        self._stream = stream
+        self._owners = owners
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def close(self):
+        self._stream.close()
+        for owner in self._owners:
+            owner.close()
+
+
+def open_source(source):
+    # binary stream over a file path or bytes holding an SDMX-ML message,
+    # plain or gzip or zip compressed (the first .xml member, else the
+    # first member); plain files are memory-mapped rather than read
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(source)
+    else:
+        stream = open(source, 'rb')
+    magic = stream.read(4)
+    stream.seek(0)
+    if magic[:2] == b'\x1f\x8b':
+        return _Closing(gzip.GzipFile(fileobj=stream), stream)
+    if magic == b'PK\x03\x04':
+        with contextlib.ExitStack() as owners:
+            owners.callback(stream.close)
+            archive = owners.enter_context(zipfile.ZipFile(stream))
+            names = archive.namelist()
+            if not names:
+                raise ValueError("Empty archive {}".format(source))
+            member = archive.open(next((name for name in names
+                if name.lower().endswith('.xml')), names[0]))
+            owners.pop_all()
+        return _Closing(member, archive, stream)
+    if isinstance(stream, io.BytesIO) or not os.fstat(stream.fileno()).st_size:
+        return stream
+    with stream:
+        return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_source(source):
+    # tree of a message from open_source, fed to the parser chunk by chunk
+    # as query_rest does with a response
+    parser = _xml_parser()
+    with contextlib.closing(open_source(source)) as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            parser.feed(chunk)
+    return parser.close()
 
 
-def query_rest(url):
+class _Structure(object):
+    # constructors of the structure classes for messages held locally
+    @classmethod
+    def from_file(cls, path):
+        return cls(parse_source(path))
 
-    request = requests.get(url, timeout= 20)
-    if request.status_code != requests.codes.ok:
-        raise ValueError("Error getting client({})".format(request.status_code))      
-    parser = lxml.etree.XMLParser(
-            ns_clean=True, recover=True, encoding='utf-8')
-    return lxml.etree.fromstring(
-            request.text.encode('utf-8'), parser=parser)
+    @classmethod
+    def from_bytes(cls, content):
+        return cls(parse_source(content))
 
 
-class Codelist(object): 
+class HTTPCache(object):
+    # seconds a stored response is served without asking the server
+    ttl = {
+            'Dataflow': 24 * 3600,
+            'CodeList': 7 * 24 * 3600,
+            'KeyFamily': 7 * 24 * 3600,
+            'Concept': 7 * 24 * 3600,
+            'CategoryScheme': 24 * 3600,
+            }
+    default_ttl = 3600
+
+    def __init__(self, directory, max_size=256 * 2 ** 20, ttl=None,
+            offline=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.offline = offline
+        if ttl is not None:
+            self.ttl = dict(self.ttl, **ttl)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _load(self, url):
+        path = self._path(url)
+        try:
+            with open(path + '.json') as meta:
+                entry = json.load(meta)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(path + '.gz'):
+            return None
+        return entry
+
+    def _payload(self, url):
+        path = self._path(url) + '.gz'
+        with open(path, 'rb') as payload:
+            content = gzip.decompress(payload.read())
+        # reads refresh the LRU position of the entry
+        os.utime(path)
+        return content
+
+    def _write(self, path, content, mode='wb'):
+        temporary = path + '.tmp'
+        with open(temporary, mode) as file_:
+            file_.write(content)
+        os.replace(temporary, path)
+
+    def _store(self, url, entry, content=None):
+        path = self._path(url)
+        if content is not None:
+            self._write(path + '.gz', gzip.compress(content))
+        self._write(path + '.json', json.dumps(entry), mode='w')
+        if content is not None:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.gz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path[:-3]))
+            size += stat.st_size
+        entries.sort()
+        while size > self.max_size and entries:
+            _, entry_size, path = entries.pop(0)
+            for suffix in ('.gz', '.json'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            size -= entry_size
+
+    def fetch(self, url, resource, transport, stats=None):
+        if stats is None:
+            stats = _no_stats
+        entry = self._load(url)
+        if entry is not None:
+            age = time.time() - entry['stored']
+            if self.offline or age < self.ttl.get(resource, self.default_ttl):
+                stats.count('cache_hits')
+                return self._payload(url)
+        elif self.offline:
+            stats.count('cache_misses')
+            raise ValueError("Not in cache while offline({})".format(url))
+        stats.count('cache_misses')
+        stats.count('requests')
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        with stats.phase('request'):
+            request = transport.get(url, headers=headers)
+        if request.status_code == 304 and entry is not None:
+            stats.count('cache_revalidated')
+            entry['stored'] = time.time()
+            self._store(url, entry)
+            return self._payload(url)
+        if request.status_code != requests.codes.ok:
+            raise StatusError(request.status_code)
+        content = request.content
+        stats.count('bytes', len(content))
+        stats.count('wire_bytes', _wire_bytes(request))
+        self._store(url, {
+            'url': url,
+            'stored': time.time(),
+            'etag': request.headers.get('ETag'),
+            'last_modified': request.headers.get('Last-Modified'),
+            }, content)
+        return content
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(('.gz', '.json')):
+                os.remove(os.path.join(self.directory, name))
+
+
+def _estimated_size(value):
+    # bytes a parsed result holds on to, from the elements of its tree
+    tree = getattr(value, 'tree', None)
+    if tree is not None and lxml.etree.iselement(tree):
+        return sum(1 for _ in tree.iter()) * ResultCache.element_size
+    return sys.getsizeof(value)
+
+
+class ResultCache(object):
+    # parsed results shared by the threads of a process, keyed by the
+    # full request; entries live for the ttl of their resource and the
+    # least recently used go past max_size estimated bytes. A request
+    # already being fetched is waited for rather than sent again
+    ttl = dict(HTTPCache.ttl, OrganisationScheme=24 * 3600)
+    default_ttl = 3600
+    # estimated bytes per element of a parsed tree, libxml2 node, name,
+    # attributes and text
+    element_size = 256
+
+    def __init__(self, max_size=128 * 2 ** 20, ttl=None):
+        self.max_size = max_size
+        if ttl is not None:
+            self.ttl = dict(self.ttl, **ttl)
+        # key: (stored, size, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        # key: Future of the fetch in flight
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, resource, compute, stats=None):
+        if stats is None:
+            stats = _no_stats
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] < self.ttl.get(resource,
+                        self.default_ttl):
+                    self._entries.move_to_end(key)
+                    stats.count('result_hits')
+                    return entry[2]
+                self._remove(key)
+            future = self._running.get(key)
+            running = future is not None
+            if not running:
+                future = self._running[key] = concurrent.futures.Future()
+        if running:
+            stats.count('result_coalesced')
+            return future.result()
+        stats.count('result_misses')
+        try:
+            value = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._running[key]
+            future.set_exception(error)
+            raise
+        size = _estimated_size(value)
+        with self._lock:
+            del self._running[key]
+            if size <= self.max_size:
+                self._entries[key] = (time.monotonic(), size, value)
+                self._size += size
+                self._evict()
+        future.set_result(value)
+        return value
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class _Namespace(object):
+    # Clark-notation names of the elements of one namespace, resolved
+    # once and shared by every document using that namespace
+    _namespaces = {}
+
+    def __init__(self, uri):
+        self.uri = uri
+        self._paths = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        tag = '{%s}%s' % (self.uri, name)
+        setattr(self, name, tag)
+        return tag
+
+    def path(self, *names):
+        # child path such as SeriesKey/Value in ElementPath syntax
+        path = self._paths.get(names)
+        if path is None:
+            path = self._paths[names] = '/'.join(
+                    getattr(self, name) for name in names)
+        return path
+
+    @classmethod
+    def of(cls, uri):
+        namespace = cls._namespaces.get(uri)
+        if namespace is None:
+            namespace = cls._namespaces[uri] = cls(uri)
+        return namespace
+
+
+def _namespace(element, prefix=None):
+    if prefix is None:
+        return _Namespace.of(lxml.etree.QName(element).namespace)
+    return _Namespace.of(element.nsmap.get(prefix))
+
+
+_xpaths = {}
+
+
+def _xpath(expression, nsmap):
+    # compiled once per expression and set of namespaces
+    namespaces = tuple(sorted((prefix, uri)
+        for prefix, uri in nsmap.items() if prefix))
+    xpath = _xpaths.get((expression, namespaces))
+    if xpath is None:
+        xpath = _xpaths[(expression, namespaces)] = lxml.etree.XPath(
+                expression, namespaces=dict(namespaces),
+                smart_strings=False)
+    return xpath
+
+
+def _codelists(tree):
+    codes = {}
+    structure = _namespace(tree, 'structure')
+    for codelist in _xpath('.//message:CodeLists/structure:CodeList',
+            tree.nsmap)(tree):
+        name = codelist.findtext(structure.Name)
+        values = _xpath('structure:Code/@value', tree.nsmap)(codelist)
+        descriptions = _xpath('structure:Code/structure:Description[1]/text()',
+                tree.nsmap)(codelist)
+        if len(values) == len(descriptions) == \
+                _xpath('count(structure:Code)', tree.nsmap)(codelist):
+            codes[name] = list(zip(values, descriptions))
+            continue
+        code = []
+        for code_ in codelist.iterchildren(structure.Code):
+            code.append((code_.get('value'),
+                code_.findtext(structure.Description)))
+        codes[name] = code
+    return codes
+
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+
+class CodeIndex(collections.abc.Mapping):
+    # codes of one codelist mapped to their labels in every language the
+    # message gives; codes and labels are interned so that codelists
+    # repeating them share a single copy
+    def __init__(self, id, name, codes, labels, language=None):
+        self.id = id
+        self.name = name
+        self.codes = tuple(sys.intern(code) for code in codes)
+        self._positions = dict((code, i) for i, code in enumerate(self.codes))
+        # {language: labels aligned with codes}
+        self.labels = dict((language_, tuple(sys.intern(label)
+            if label is not None else None for label in labels_))
+            for language_, labels_ in labels.items())
+        if language is None:
+            language = 'en' if 'en' in self.labels \
+                    else next(iter(self.labels), None)
+        self.language = language
+        self._reverse = {}
+
+    def __getstate__(self):
+        # the lookups are rebuilt on load, not stored
+        state = dict(self.__dict__)
+        del state['_positions']
+        state['_reverse'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._positions = dict((code, i)
+                for i, code in enumerate(self.codes))
+
+    def __getitem__(self, code):
+        return self.label(code)
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self._positions
+
+    def label(self, code, language=None):
+        labels = self.labels.get(language or self.language)
+        position = self._positions[code]
+        return labels[position] if labels is not None else None
+
+    def code(self, label, language=None):
+        # reverse lookup of a label, ignoring case
+        language = language or self.language
+        reverse = self._reverse.get(language)
+        if reverse is None:
+            reverse = self._reverse[language] = dict(
+                    (label_.casefold(), code) for code, label_ in
+                    zip(self.codes, self.labels.get(language, ()))
+                    if label_ is not None)
+        return reverse.get(label.casefold())
+
+    def search(self, text, language=None):
+        text = text.casefold()
+        return [code for code, label in zip(self.codes,
+            self.labels.get(language or self.language, ()))
+            if label is not None and text in label.casefold()]
+
+    def invalid(self, codes):
+        return [code for code in codes if code not in self._positions]
+
+
+def _code_indexes(tree):
+    indexes = {}
+    structure = _namespace(tree, 'structure')
+    for codelist in _xpath('.//message:CodeLists/structure:CodeList',
+            tree.nsmap)(tree):
+        codes = []
+        labels = {}
+        for code_ in codelist.iterchildren(structure.Code):
+            for description in code_.iterchildren(structure.Description):
+                language = description.get(XML_LANG, '')
+                labels_ = labels.get(language)
+                if labels_ is None:
+                    labels_ = labels[language] = [None] * len(codes)
+                if len(labels_) == len(codes):
+                    labels_.append(description.text)
+            codes.append(code_.get('value'))
+            for labels_ in labels.values():
+                if len(labels_) < len(codes):
+                    labels_.append(None)
+        name = codelist.findtext(structure.Name)
+        indexes[name] = CodeIndex(codelist.get('id'), name, codes, labels)
+    return indexes
+
+
+class Codelist(_Structure): 
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._codes = None
+        self._index = None
 
     @property
     def codes(self):
-        if not self._codes:
-            self._codes = {}
-            codelists = self.tree.xpath(".//message:CodeLists",
-                    namespaces=self.tree.nsmap)
-            for codelists_ in codelists:
-                for codelist in codelists_.iterfind(".//structure:CodeList",
-                        namespaces=self.tree.nsmap):
-                    name = codelist.xpath('.//structure:Name', namespaces=self.tree.nsmap)
-                    name = name[0]
-                    name = name.text
-                    code = []
-                    for code_ in codelist.iterfind(".//structure:Code",
-                            namespaces=self.tree.nsmap):
-                        code_key = code_.get('value')
-                        code_name = code_.xpath('.//structure:Description',
-                                namespaces=self.tree.nsmap)
-                        code_name = code_name[0]
-                        code.append((code_key,code_name.text))
-                    self._codes[name] = code
+        if self._codes is None:
+            self._codes = _codelists(self.tree)
         return self._codes
 
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = _code_indexes(self.tree)
+        return self._index
+
 
-class Dataflows(object):  
+class Dataflows(_Structure):  
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._all_dataflows = None
 
     @property
     def all_dataflows(self):  
-        if not self._all_dataflows:
+        if self._all_dataflows is None:
             self._all_dataflows = {}
-            for dataflow in self.tree.iterfind(".//structure:Dataflow",
-                    namespaces=self.tree.nsmap):
+            structure = _namespace(self.tree, 'structure')
+            for dataflow in _xpath('.//structure:Dataflow',
+                    self.tree.nsmap)(self.tree):
                 id = dataflow.get('id')
                 agencyID = dataflow.get('agencyID')
                 version = dataflow.get('version')
-                name = dataflow.xpath('.//structure:Name', namespaces=self.tree.nsmap)[0].text
-                for keyfamilyref in dataflow.iterfind(".//structure:KeyFamilyRef",
-                        namespaces=self.tree.nsmap):
-                    keyfamilyid = keyfamilyref.xpath('.//structure:KeyFamilyID', namespaces=self.tree.nsmap)[0].text
-                    keyfamilyagenceid =  keyfamilyref.xpath('.//structure:KeyFamilyAgencyID', namespaces=self.tree.nsmap)[0].text
-                categoryscheme = dataflow.xpath('.//structure:CategorySchemeID', namespaces=self.tree.nsmap)[0].text
-                categoryID = dataflow.xpath('.//structure:ID', namespaces=self.tree.nsmap)[0].text
+                name = dataflow.findtext(structure.Name)
+                keyfamilyid = dataflow.findtext(
+                        structure.path('KeyFamilyRef', 'KeyFamilyID'))
+                keyfamilyagenceid = dataflow.findtext(
+                        structure.path('KeyFamilyRef', 'KeyFamilyAgencyID'))
+                categoryscheme = dataflow.findtext(
+                        structure.path('CategoryRef', 'CategorySchemeID'))
+                categoryID = dataflow.findtext(
+                        structure.path('CategoryRef', 'CategoryID', 'ID'))
                 self._all_dataflows[id] = (agencyID, version, name,
                         keyfamilyid,
                         keyfamilyagenceid,categoryscheme,categoryID ) 
-                return self._all_dataflows
+        return self._all_dataflows
+
+
+def _upsert(stored, delta):
+    # stored and delta are (dates, values, status) of one series, delta
+    # observations replace stored ones for the same period
+    dates, values, status = stored
+    keep = ~numpy.isin(dates, delta[0])
+    dates = numpy.concatenate([dates[keep], delta[0]])
+    order = numpy.argsort(dates, kind='stable')
+    return (dates[order],
+            numpy.concatenate([values[keep], delta[1]])[order],
+            numpy.concatenate([status[keep], delta[2]])[order])
+
+
+def _float_values(values):
+    # observation values as float64, missing values and markers such as
+    # NaN or '-' as NaN
+    if getattr(values, 'dtype', None) is not None \
+            and values.dtype.kind == 'f':
+        return values
+    try:
+        return numpy.array(values, dtype='float64')
+    except (TypeError, ValueError):
+        return pandas.to_numeric(pandas.Series(values, dtype=object),
+                errors='coerce').to_numpy(dtype='float64')
+
+
+def _code_set(codes):
+    # a code or a list of codes as a set
+    if isinstance(codes, (list, tuple, set)):
+        return set(codes)
+    return {codes}
+
+
+class SeriesStore(object):
+    # every flow is kept as three contiguous columns, memory-mapped on
+    # read: dates as int64 nanoseconds, values as float64 and the
+    # observation status as int8 codes into the flow's status list; other
+    # observation attributes are not stored
+    columns = (
+            ('dates', 'int64'),
+            ('values', 'float64'),
+            ('status', 'int8'),
+            )
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def index(self):
+        # {flowRef: {'dimensions': [...], 'status': [...],
+        # 'series': {key: {'codes': {...}, 'offset': ..., 'length': ...,
+        # 'fetched': updatedAfter timestamp, 'last': last period}}}}
+        if self._index is None:
+            try:
+                with open(os.path.join(self.directory, 'index.json')) as index:
+                    self._index = json.load(index)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as index:
+            json.dump(self.index, index)
+        os.replace(path + '.tmp', path)
+
+    def _path(self, flowRef, column):
+        # the columns of a flow compacted n times are column.n
+        generation = self.index.get(flowRef, {}).get('generation', 0)
+        if generation:
+            column = '{}.{}'.format(column, generation)
+        return os.path.join(self.directory, flowRef, column)
+
+    def _columns(self, flowRef):
+        columns = []
+        for column, dtype in self.columns:
+            path = self._path(flowRef, column)
+            if os.path.getsize(path):
+                columns.append(numpy.memmap(path, dtype=dtype, mode='r'))
+            else:
+                columns.append(numpy.empty(0, dtype=dtype))
+        columns[0] = columns[0].view('datetime64[ns]')
+        return columns
+
+    def keys(self, flowRef):
+        flow = self.index.get(flowRef, {'series': {}})
+        return [tuple(name.split('.')) for name in flow['series']]
+
+    def arrays(self, flowRef, key):
+        # views on the mapped columns, nothing is copied
+        if not isinstance(key, str):
+            key = '.'.join(key)
+        entry = self.index[flowRef]['series'][key]
+        start = entry['offset']
+        stop = start + entry['length']
+        return [column[start:stop] for column in self._columns(flowRef)]
+
+    def series(self, flowRef, key):
+        dates, values, _ = self.arrays(flowRef, key)
+        return pandas.Series(values, index=pandas.DatetimeIndex(dates),
+                copy=False)
+
+    def load(self, flowRef, keys=None):
+        # the series of keys, all of them by default, on views of the
+        # mapped columns when they are stored one after the other in the
+        # order asked for, as the series of keys() are unless updates
+        # left observations behind; otherwise their observations are
+        # taken out of the columns in a single copy
+        flow = self.index.get(flowRef)
+        if flow is None:
+            return None
+        if keys is None:
+            names = list(flow['series'])
+        else:
+            names = [key if isinstance(key, str) else '.'.join(key)
+                    for key in keys]
+        entries = [flow['series'][name] for name in names]
+        lengths = [entry['length'] for entry in entries]
+        dates, values, status = self._columns(flowRef)
+        start = entries[0]['offset'] if entries else 0
+        if all(entry['offset'] == start + offset for entry, offset
+                in zip(entries, numpy.cumsum([0] + lengths[:-1]))):
+            observations = slice(start, start + sum(lengths))
+        else:
+            observations = numpy.concatenate([numpy.arange(entry['offset'],
+                entry['offset'] + entry['length']) for entry in entries])
+        data = Data(None)
+        data._assign_columns(flow['dimensions'],
+                [tuple(name.split('.')) for name in names],
+                [entry['codes'] for entry in entries], lengths,
+                dates[observations], values[observations], {'OBS_STATUS':
+                    pandas.Categorical.from_codes(status[observations],
+                        flow['status'])})
+        return data
+
+    def update(self, flowRef, data, fetched, **dimensions):
+        # the series of data and the stored series matching dimensions,
+        # the query data answered, are stamped as fetched; series data
+        # changes are merged and appended to the columns, their index
+        # entries pointed at the new observations and moved last, so that
+        # the index keeps the order of the columns, while the others stay
+        # where they are
+        with self._lock:
+            flow = self.index.setdefault(flowRef,
+                    {'series': {}, 'status': []})
+            stamp = fetched.strftime('%Y-%m-%dT%H:%M:%SZ')
+            for name in self._matching(flow, dimensions):
+                flow['series'][name]['fetched'] = stamp
+            if dimensions:
+                # the query itself, for codes it found no series for
+                dimensions = dict((name, sorted(_code_set(codes)))
+                        for name, codes in dimensions.items())
+                flow.setdefault('queries', {})[json.dumps(dimensions,
+                    sort_keys=True)] = {'dimensions': dimensions,
+                            'fetched': stamp}
+            os.makedirs(os.path.join(self.directory, flowRef), exist_ok=True)
+            for column, _ in self.columns:
+                open(self._path(flowRef, column), 'ab').close()
+            stored = self._columns(flowRef)
+            series = []
+            for key, codes, dates, values, attributes in data._slices():
+                name = '.'.join(key)
+                delta = (dates, values, numpy.asarray(
+                    attributes['OBS_STATUS'], dtype=object))
+                entry = flow['series'].get(name, {})
+                if 'offset' in entry:
+                    start = entry['offset']
+                    stop = start + entry['length']
+                    delta = _upsert((stored[0][start:stop],
+                        stored[1][start:stop],
+                        numpy.asarray(pandas.Categorical.from_codes(
+                            stored[2][start:stop], flow['status']),
+                            dtype=object)), delta)
+                    # observations sent again as they are stored
+                    if len(delta[0]) == entry['length'] \
+                            and numpy.array_equal(delta[0],
+                                stored[0][start:stop]) \
+                            and numpy.array_equal(delta[1],
+                                stored[1][start:stop], equal_nan=True) \
+                            and numpy.array_equal(pandas.Categorical(
+                                delta[2], categories=flow['status']).codes,
+                                stored[2][start:stop]):
+                        entry['fetched'] = stamp
+                        continue
+                    del flow['series'][name]
+                series.append((name, codes, delta))
+            # known once data is read
+            flow['dimensions'] = data._dimensions or \
+                    flow.get('dimensions', [])
+            status = numpy.concatenate([delta[2]
+                for _, _, delta in series]) if series \
+                        else numpy.empty(0, dtype=object)
+            for code in pandas.unique(status):
+                if not pandas.isna(code) and code not in flow['status']:
+                    flow['status'].append(code)
+            status = pandas.Categorical(status,
+                    categories=flow['status']).codes.astype('int8')
+            offset = len(stored[0])
+            for name, codes, (dates, _, _) in series:
+                flow['series'][name] = {
+                        'fetched': stamp,
+                        'codes': codes,
+                        'offset': offset,
+                        'length': len(dates),
+                        'last': str(dates[-1])[:10] if len(dates) else None,
+                        }
+                offset += len(dates)
+            dates = numpy.concatenate([delta[0]
+                for _, _, delta in series]) if series \
+                        else numpy.empty(0, dtype='datetime64[ns]')
+            values = numpy.concatenate([delta[1]
+                for _, _, delta in series]) if series \
+                        else numpy.empty(0, dtype='float64')
+            # the index is saved last, observations appended by an update
+            # that did not get that far are never pointed at
+            for (column, dtype), array in zip(self.columns,
+                    (dates.astype('datetime64[ns]').view('int64'),
+                        values, status)):
+                with open(self._path(flowRef, column), 'ab') as file_:
+                    numpy.ascontiguousarray(array, dtype=dtype).tofile(file_)
+            if offset > 2 * sum(entry['length']
+                    for entry in flow['series'].values()):
+                self._compact(flowRef)
+            else:
+                self._save_index()
+
+    def _compact(self, flowRef):
+        # copy the observations series still point at to columns of the
+        # next generation, once the others are more than half of them; the
+        # index saved, the columns of the previous generation are removed
+        flow = self.index[flowRef]
+        stored = self._columns(flowRef)
+        previous = [self._path(flowRef, column) for column, _ in self.columns]
+        ranges = []
+        offset = 0
+        for entry in flow['series'].values():
+            ranges.append(numpy.arange(entry['offset'],
+                entry['offset'] + entry['length']))
+            entry['offset'] = offset
+            offset += entry['length']
+        ranges = numpy.concatenate(ranges) if ranges \
+                else numpy.empty(0, dtype='int64')
+        flow['generation'] = flow.get('generation', 0) + 1
+        for (column, dtype), array in zip(self.columns, stored):
+            with open(self._path(flowRef, column), 'wb') as file_:
+                numpy.ascontiguousarray(array[ranges]).view(dtype).tofile(
+                        file_)
+        self._save_index()
+        for path in previous:
+            os.remove(path)
+
+    def since(self, flowRef, **dimensions):
+        # oldest fetch time and oldest last period over the stored series
+        # matching the dimension codes, None when nothing matches
+        flow = self.index.get(flowRef)
+        if flow is None:
+            return None, None
+        fetched = []
+        last = []
+        for name in self._matching(flow, dimensions):
+            entry = flow['series'][name]
+            if 'fetched' in entry:
+                fetched.append(entry['fetched'])
+            if entry.get('last') is not None:
+                last.append(entry['last'])
+        if not fetched:
+            # a query that covered the codes and found nothing for them
+            fetched = [query['fetched']
+                    for query in flow.get('queries', {}).values()
+                    if dimensions and all(_code_set(codes)
+                        <= set(query['dimensions'].get(name, ()))
+                        for name, codes in dimensions.items())]
+            return max(fetched) if fetched else None, None
+        return min(fetched), min(last) if last else None
+
+    @staticmethod
+    def _matching(flow, dimensions):
+        positions = [(flow['dimensions'].index(name), _code_set(codes))
+            for name, codes in dimensions.items()
+            if name in flow.get('dimensions', [])]
+        for name in flow['series']:
+            key = name.split('.')
+            if all(key[i] in codes for i, codes in positions):
+                yield name
+
+
+def _release(element):
+    # drop an element that has been consumed by iterparse together with
+    # the siblings already processed before it, so the partial tree stays
+    # small however many series the message holds
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+    parent = element.getparent()
+    if parent is not None:
+        while parent.getprevious() is not None:
+            del parent.getparent()[0]
+
+
+def _generic_key(series):
+    generic = _namespace(series)
+    key = {}
+    for value in series.iterfind(generic.path('SeriesKey', 'Value')):
+        key[value.get('concept')] = value.get('value')
+    attributes = {}
+    for value in series.iterfind(generic.path('Attributes', 'Value')):
+        attributes[value.get('concept')] = value.get('value')
+    return key, attributes
+
+
+def _generic_series(series):
+    generic = _namespace(series)
+    nsmap = {'generic': generic.uri}
+    key, attributes = _generic_key(series)
+    # whole columns at once, which only line up when every observation
+    # carries its period, value and the attributes of the first one
+    observations = _xpath('count(generic:Obs)', nsmap)(series)
+    dimensions = _xpath('generic:Obs/generic:Time/text()', nsmap)(series)
+    values = _xpath('generic:Obs/generic:ObsValue/@value', nsmap)(series)
+    names = _xpath('generic:Obs[1]/generic:Attributes/generic:Value/'
+            '@concept', nsmap)(series)
+    concepts = _xpath('generic:Obs/generic:Attributes/generic:Value/'
+            '@concept', nsmap)(series)
+    attribute_values = _xpath('generic:Obs/generic:Attributes/'
+            'generic:Value/@value', nsmap)(series)
+    observations = int(observations)
+    if len(dimensions) == len(values) == observations \
+            and len(concepts) == len(attribute_values) \
+                == observations * len(names):
+        # one row of attribute values per observation, in the order of
+        # the first one
+        shape = (observations, len(names))
+        if (numpy.array(concepts, dtype=object).reshape(shape)
+                == numpy.array(names, dtype=object)).all():
+            columns = numpy.array(attribute_values,
+                    dtype=object).reshape(shape)
+            return key, attributes, dimensions, values, dict(
+                    (name, columns[:, i]) for i, name in enumerate(names))
+    dimensions = []
+    values = []
+    observation_attributes = {}
+    for i, observation in enumerate(series.iterchildren(generic.Obs)):
+        dimensions.append(observation.findtext(generic.Time))
+        value = observation.find(generic.ObsValue)
+        values.append(value.get('value') if value is not None else None)
+        for value in observation.iterfind(
+                generic.path('Attributes', 'Value')):
+            observation_attributes.setdefault(value.get('concept'),
+                    [None] * i).append(value.get('value'))
+        for column in observation_attributes.values():
+            if len(column) == i:
+                column.append(None)
+    return key, attributes, dimensions, values, observation_attributes
+
+
+def _attribute_columns(parts, lengths):
+    # parts holds a dict of attribute columns for each run of lengths[i]
+    # observations; gives every attribute one object array per run, with
+    # None where a run lacks it
+    names = []
+    for part in parts:
+        names.extend(name for name in part if name not in names)
+    return dict((name, [numpy.asarray(part[name], dtype=object)
+        if name in part else numpy.full(length, None, dtype=object)
+        for part, length in zip(parts, lengths)]) for name in names)
+
+
+def _collect_series(series):
+    # series yields _generic_series tuples; gives the dimension names and
+    # the per-series keys, codes and period-sorted columns, observation
+    # attributes as {name: [object array per series]}
+    dimensions = None
+    keys = []
+    codes_ = []
+    dates = []
+    values = []
+    attributes_ = []
+    for key, attributes, periods, values_, observation_attributes in series:
+        if dimensions is None:
+            dimensions = list(key)
+        dates_ = numpy.asarray(time_index(periods, key.get('FREQ')),
+                dtype='datetime64[ns]')
+        order = numpy.argsort(dates_, kind='stable')
+        keys.append(tuple(key.values()))
+        codes = dict(key)
+        codes.update(attributes)
+        codes_.append(codes)
+        dates.append(dates_[order])
+        values.append(_float_values(values_)[order])
+        attributes_.append(dict((name, numpy.array(column,
+            dtype=object)[order])
+            for name, column in observation_attributes.items()))
+    return dimensions, keys, codes_, dates, values, _attribute_columns(
+            attributes_, [len(dates_) for dates_ in dates])
+
+
+def _series_spans(content):
+    # namespace declarations of the root element of a GenericData message
+    # and the byte spans of its generic:Series elements
+    root = re.search(rb'<(?:[\w.-]+:)?GenericData\b[^>]*>', content)
+    if root is None:
+        return [], []
+    declarations = re.findall(rb'xmlns(?::([\w.-]+))?="([^"]*)"',
+            root.group(0))
+    prefixes = [prefix for prefix, uri in declarations
+            if uri.endswith(b'/generic')]
+    if not prefixes:
+        return declarations, []
+    tag = prefixes[0] + b':Series' if prefixes[0] else b'Series'
+    spans = []
+    for start in re.finditer(b'<' + re.escape(tag) + rb'(?=[\s>/])',
+            content):
+        start = start.start()
+        opened = content.index(b'>', start)
+        if content[opened - 1:opened] == b'/':
+            end = opened + 1
+        else:
+            end = content.find(b'</' + tag + b'>', opened)
+            if end < 0:
+                return declarations, []
+            end += len(tag) + 3
+        spans.append((start, end))
+    return declarations, spans
+
+
+def _parse_chunk(content):
+    # process pool worker, returns plain arrays that are cheap to pickle
+    tree = parse_xml(content)
+    dimensions, keys, codes, dates, values, attributes = _collect_series(
+            _generic_series(series) for series in tree)
+    return (dimensions, keys, codes,
+            numpy.array([len(dates_) for dates_ in dates], dtype='int64'),
+            numpy.concatenate(dates).view('int64') if dates
+                else numpy.empty(0, dtype='int64'),
+            numpy.concatenate(values) if values
+                else numpy.empty(0, dtype='float64'),
+            dict((name, pandas.Categorical(numpy.concatenate(columns)))
+                for name, columns in attributes.items()))
+
+
+def _time_column(periods, names, frequencies=None):
+    # periods holds positions into names, the distinct period strings;
+    # each of them is parsed once per frequency that uses it
+    dates = numpy.empty(len(periods), dtype='datetime64[ns]')
+    if frequencies is None:
+        frequencies = numpy.full(len(periods), None, dtype=object)
+    for frequency in pandas.unique(frequencies):
+        rows = frequencies == frequency
+        used = numpy.unique(periods[rows])
+        parsed = numpy.empty(len(names), dtype='datetime64[ns]')
+        parsed[used] = time_index(names[used], frequency)
+        dates[rows] = parsed[periods[rows]]
+    return dates
+
+
+def _sort_series(series, count, dates, values, attributes):
+    # rows in any order, series[i] numbering the series of row i; gives
+    # the series lengths and the rows grouped by series in period order
+    order = numpy.lexsort((dates.view('int64'), series))
+    return (numpy.bincount(series, minlength=count), dates[order],
+            values[order], dict((name, column[order])
+                for name, column in attributes.items()))
+
+
+def _components(keyfamily):
+    # components of the first key family of a Keyfamily, or as given
+    if isinstance(keyfamily, Keyfamily):
+        return next(iter(keyfamily.components.values()), None)
+    return keyfamily
+
+
+# SDMX-CSV columns describing the message rather than a component
+CSV_COLUMNS = ('DATAFLOW', 'STRUCTURE', 'STRUCTURE_ID', 'ACTION')
+
+
+def _csv_columns(content, components=None):
+    # one typed pass of read_csv: codes as categoricals, values as floats,
+    # and the periods parsed once per distinct period and frequency
+    columns = list(pandas.read_csv(io.BytesIO(content), nrows=0).columns)
+    if components is not None:
+        time_ = components['time']
+        measure = components['measure']
+        dimensions = [dimension for dimension, _
+                in components['dimensions']]
+        attributes = [attribute for attribute, _, level
+                in components['attributes']
+                if level != 'Observation' and attribute in columns]
+        observation_attributes = [attribute for attribute, _, level
+                in components['attributes']
+                if level == 'Observation' and attribute in columns]
+    else:
+        # without the key family, the dimensions are the columns before
+        # the period and the attributes after the value are taken as
+        # series attributes unless named as observation ones
+        time_ = 'TIME_PERIOD'
+        measure = 'OBS_VALUE'
+        dimensions = [column for column in columns[:columns.index(time_)]
+                if column not in CSV_COLUMNS]
+        attributes = [column for column
+                in columns[columns.index(measure) + 1:]
+                if not column.startswith('OBS_')]
+        observation_attributes = [column for column
+                in columns[columns.index(measure) + 1:]
+                if column.startswith('OBS_')]
+    categorical = dimensions + attributes + observation_attributes
+    dtype = dict((column, 'category') for column in categorical)
+    dtype[time_] = str
+    dtype[measure] = 'float64'
+    # codes such as NA (Namibia) stay codes, only empty values are missing
+    missing = dict((column, ['']) for column in observation_attributes)
+    missing[measure] = ['', 'NaN']
+    frame = pandas.read_csv(io.BytesIO(content), usecols=categorical
+            + [time_, measure], dtype=dtype, keep_default_na=False,
+            na_values=missing)
+    series = frame.groupby(dimensions, observed=True,
+            sort=False).ngroup().to_numpy()
+    first = numpy.unique(series, return_index=True)[1]
+    heads = dict((column, frame[column].to_numpy(dtype=object)[first])
+            for column in dimensions + attributes)
+    keys = list(zip(*[heads[dimension] for dimension in dimensions])) \
+            if dimensions else [()] * len(first)
+    codes = [dict((column, heads[column][i])
+        for column in dimensions + attributes) for i in range(len(first))]
+    periods, names = pandas.factorize(frame[time_].to_numpy(dtype=object))
+    dates = _time_column(periods, numpy.asarray(names, dtype=object),
+            frame['FREQ'].to_numpy(dtype=object)
+            if 'FREQ' in dimensions else None)
+    return (dimensions, keys, codes) + _sort_series(series, len(keys),
+            dates, frame[measure].to_numpy(), dict((column,
+                frame[column].array) for column in observation_attributes))
+
+
+def _json_columns(content):
+    # SDMX-JSON 1.0 with series: observations are [value, attributes...]
+    # lists keyed by period position, codes are positions into the
+    # structure, so only the positions go through python objects
+    message = json.loads(content)
+    structure = message['structure']
+    series_dimensions = structure['dimensions']['series']
+    dimensions = [dimension['id'] for dimension in series_dimensions]
+    dimension_codes = [[value['id'] for value in dimension['values']]
+            for dimension in series_dimensions]
+    names = numpy.array([value['id'] for value
+        in structure['dimensions']['observation'][0]['values']],
+        dtype=object)
+    attributes = structure.get('attributes', {})
+    series_attributes = [(attribute['id'],
+        [value['id'] for value in attribute['values']])
+        for attribute in attributes.get('series', [])]
+    # observation attribute i is at position i + 1 of an observation
+    observation_attributes = [(attribute['id'],
+        [value['id'] for value in attribute['values']])
+        for attribute in attributes.get('observation', [])]
+    keys = []
+    codes = []
+    lengths = []
+    periods = []
+    values = []
+    positions = [[] for _ in observation_attributes]
+    datasets = message.get('dataSets') or [{}]
+    for series_key, series in datasets[0].get('series', {}).items():
+        key = tuple(dimension_codes[i][int(position)]
+                for i, position in enumerate(series_key.split(':')))
+        codes_ = dict(zip(dimensions, key))
+        for (attribute, attribute_codes), position in zip(
+                series_attributes, series.get('attributes', [])):
+            if position is not None:
+                codes_[attribute] = attribute_codes[position]
+        observations = series.get('observations', {})
+        keys.append(key)
+        codes.append(codes_)
+        lengths.append(len(observations))
+        periods.append(numpy.fromiter(observations, dtype='int64',
+            count=len(observations)))
+        observations = observations.values()
+        values.extend(observation[0] for observation in observations)
+        for i, positions_ in enumerate(positions, 1):
+            positions_.extend(observation[i] if len(observation) > i
+                    and observation[i] is not None else -1
+                    for observation in observations)
+    series = numpy.repeat(numpy.arange(len(keys)), lengths)
+    periods = numpy.concatenate(periods) if periods \
+            else numpy.empty(0, dtype='int64')
+    frequencies = None
+    if 'FREQ' in dimensions:
+        frequencies = numpy.array([key[dimensions.index('FREQ')]
+            for key in keys], dtype=object)[series]
+    # a null value becomes NaN, a missing attribute the -1 code
+    values = numpy.array(values, dtype='float64')
+    observation_attributes = dict((name, pandas.Categorical.from_codes(
+        numpy.array(positions_, dtype='int64'), categories))
+        for (name, categories), positions_
+        in zip(observation_attributes, positions))
+    return (dimensions, keys, codes) + _sort_series(series, len(keys),
+            _time_column(periods, names, frequencies), values,
+            observation_attributes)
 
 
 class Data(object):
-    def __init__(self, SDMXML):
-        self.tree = SDMXML
+    def __init__(self, SDMXML, stats=None):
+        # SDMXML is either a parsed tree or a file-like object / path
+        # holding a GenericData message, which is then read as a stream
+        self.stats = stats if stats is not None else _no_stats
+        if lxml.etree.iselement(SDMXML):
+            self.tree = SDMXML
+            self.source = None
+        else:
+            self.tree = None
+            self.source = SDMXML
         self._time_series = None
+        # columnar observations: series i spans
+        # offsets[i]:offsets[i + 1] of the flat dates and float64 values
+        # and of the observation attributes, {name: Categorical}
+        self._dimensions = None
+        self._keys = None
+        self._codes = None
+        self._offsets = None
+        self._dates = None
+        self._values = None
+        self._attributes = None
+        # series key to position, in the columns once loaded or else in
+        # _elements, the series elements of the tree whose observations
+        # are only read when the series is asked for
+        self._index = None
+        self._elements = None
+        self._materialized = {}
+        # chunks of a split query that could not be fetched
+        self.failed = []
+        # the source was opened by from_file or from_bytes and is closed
+        # once read
+        self._owned = False
+
+    def _series_elements(self):
+        return _xpath('.//generic:Series', self.tree.nsmap)(self.tree)
+
+    def _series_key(self, series):
+        return _generic_key(series)
+
+    def _series(self, series):
+        return _generic_series(series)
+
+    def iter_series(self):
+        if self.tree is not None:
+            for series in self._series_elements():
+                yield self._series(series)
+        else:
+            if self.source is None:
+                raise ValueError("Data stream has already been consumed")
+            source, self.source = self.source, None
+            try:
+                for event, series in lxml.etree.iterparse(source,
+                        events=('end',), tag='{*}Series', recover=True):
+                    yield self._series(series)
+                    _release(series)
+            finally:
+                if self._owned:
+                    source.close()
+
+    def _load(self):
+        if self._keys is not None:
+            return
+        with self.stats.phase('parse'):
+            self._collect()
+        self.stats.count('series', len(self._keys))
+        self.stats.count('observations', len(self._dates))
+
+    def _collect(self):
+        # a streamed message is downloaded while it is parsed here
+        self._assign(*_collect_series(self.iter_series()))
+
+    def _assign(self, dimensions, keys, codes, dates, values, attributes):
+        # dates and values are lists of per-series arrays, attributes
+        # {name: [per-series array]}
+        self._assign_columns(dimensions, keys, codes,
+                [len(dates_) for dates_ in dates],
+                numpy.concatenate(dates) if dates
+                    else numpy.empty(0, dtype='datetime64[ns]'),
+                numpy.concatenate(values) if values
+                    else numpy.empty(0, dtype='float64'),
+                dict((name, numpy.concatenate([numpy.asarray(column,
+                    dtype=object) for column in columns]))
+                    for name, columns in attributes.items()))
+
+    def _assign_columns(self, dimensions, keys, codes, lengths, dates,
+            values, attributes):
+        # dates and values are flat arrays, series i holding lengths[i]
+        # observations, attributes {name: flat array or Categorical}
+        self._dimensions = dimensions if dimensions is not None else []
+        self._offsets = numpy.zeros(len(keys) + 1, dtype='int64')
+        numpy.cumsum(lengths, out=self._offsets[1:])
+        self._dates = dates
+        self._values = _float_values(values)
+        attributes = dict((name, column
+            if isinstance(column, pandas.Categorical)
+            else pandas.Categorical(column))
+            for name, column in attributes.items())
+        # an observation without a status is a normal one
+        status = attributes.get('OBS_STATUS', pandas.Categorical(
+            numpy.full(len(dates), None, dtype=object)))
+        if status.isna().any():
+            if 'A' not in status.categories:
+                status = status.add_categories('A')
+            status = status.fillna('A')
+        attributes['OBS_STATUS'] = status
+        self._attributes = attributes
+        self._codes = codes
+        self._keys = keys
+
+    @classmethod
+    def parallel(cls, content, processes=None, stats=None):
+        # parse the bytes of a GenericData message in a process pool,
+        # each worker taking a run of whole generic:Series elements
+        if processes is None:
+            processes = os.cpu_count() or 1
+        declarations, spans = _series_spans(content)
+        if processes < 2 or len(spans) < 2 * processes:
+            data = cls(parse_xml(content), stats=stats)
+            data._load()
+            return data
+        data = cls(None, stats=stats)
+        # a few chunks per process keeps the workers evenly busy
+        chunks = 4 * processes
+        bounds = numpy.linspace(0, len(spans), chunks + 1).astype(int)
+        root = b'<pysdmx ' + b' '.join(b'xmlns%s="%s"'
+                % (b':' + prefix if prefix else b'', uri)
+                for prefix, uri in declarations) + b'>'
+        wrapped = (root + b''.join(content[start:end]
+            for start, end in spans[first:last]) + b'</pysdmx>'
+            for first, last in zip(bounds[:-1], bounds[1:]))
+        with data.stats.phase('parse'):
+            with concurrent.futures.ProcessPoolExecutor(processes) \
+                    as executor:
+                parts = list(executor.map(_parse_chunk, wrapped))
+            dimensions = next((part[0] for part in parts if part[0]), None)
+            data._assign_columns(dimensions,
+                    [key for part in parts for key in part[1]],
+                    [codes for part in parts for codes in part[2]],
+                    numpy.concatenate([part[3] for part in parts]),
+                    numpy.concatenate([part[4] for part in parts]
+                        ).view('datetime64[ns]'),
+                    numpy.concatenate([part[5] for part in parts]),
+                    dict((name, numpy.concatenate(columns)) for name, columns
+                        in _attribute_columns([part[6] for part in parts],
+                            [len(part[5]) for part in parts]).items()))
+        data.stats.count('series', len(data._keys))
+        data.stats.count('observations', len(data._dates))
+        return data
+
+    @classmethod
+    def from_file(cls, path, stats=None):
+        # a GenericData message on disk, plain, gzip or zip compressed,
+        # read as a stream so memory stays bounded by the series kept
+        data = cls(open_source(path), stats=stats)
+        data._owned = True
+        return data
+
+    @classmethod
+    def from_bytes(cls, content, stats=None):
+        data = cls(open_source(content), stats=stats)
+        data._owned = True
+        return data
+
+    @classmethod
+    def _from_columns(cls, columns, stats=None, *args):
+        data = cls(None, stats=stats)
+        with data.stats.phase('parse'):
+            data._assign_columns(*columns(*args))
+        data.stats.count('series', len(data._keys))
+        data.stats.count('observations', len(data._dates))
+        return data
+
+    @classmethod
+    def from_csv(cls, content, keyfamily=None, stats=None):
+        # SDMX-CSV bytes; the key family, when given, names the dimensions
+        # and the series attributes among the columns
+        return cls._from_columns(_csv_columns, stats, content,
+                _components(keyfamily))
+
+    @classmethod
+    def from_json(cls, content, stats=None):
+        # SDMX-JSON bytes
+        return cls._from_columns(_json_columns, stats, content)
+
+    @classmethod
+    def from_response(cls, content_type, content, keyfamily=None,
+            stats=None):
+        # any data message, told apart by its content type and, for XML,
+        # by its root element
+        if 'csv' in content_type:
+            return cls.from_csv(content, keyfamily, stats=stats)
+        if 'json' in content_type:
+            return cls.from_json(content, stats=stats)
+        if stats is None:
+            stats = _no_stats
+        with stats.phase('tree'):
+            tree = parse_xml(content)
+        if lxml.etree.QName(tree).localname == 'GenericData':
+            return cls(tree, stats=stats)
+        return CompactData(tree, keyfamily, stats=stats)
+
+    def _slices(self):
+        self._load()
+        for i, key in enumerate(self._keys):
+            start, stop = self._offsets[i], self._offsets[i + 1]
+            yield key, self._codes[i], self._dates[start:stop], \
+                    self._values[start:stop], dict((name,
+                        column[start:stop]) for name, column
+                        in self._attributes.items())
+
+    @classmethod
+    def merge(cls, parts):
+        # parts hold pieces of the same series over consecutive periods,
+        # given in period order; observations up to the last date kept
+        # from the earlier pieces are dropped so the series stay sorted
+        merged = cls(None)
+        dimensions = None
+        series = {}
+        last = {}
+        for part in parts:
+            for key, codes, dates, values, attributes in part._slices():
+                if dimensions is None:
+                    dimensions = part._dimensions
+                if key not in series:
+                    series[key] = (codes, [dates], [values], [attributes])
+                    last[key] = dates.max() if len(dates) else None
+                    continue
+                pieces = series[key]
+                keep = dates > last[key] if last[key] is not None \
+                        else slice(None)
+                if len(dates[keep]):
+                    last[key] = dates[keep].max()
+                pieces[1].append(dates[keep])
+                pieces[2].append(values[keep])
+                pieces[3].append(dict((name, column[keep])
+                    for name, column in attributes.items()))
+        keys = list(series)
+        dates = [numpy.concatenate(series[key][1]) for key in keys]
+        merged._assign(dimensions, keys,
+                [series[key][0] for key in keys], dates,
+                [numpy.concatenate(series[key][2]) for key in keys],
+                _attribute_columns([dict((name, numpy.concatenate(columns))
+                    for name, columns in _attribute_columns(series[key][3],
+                        [len(dates_) for dates_ in series[key][1]]).items())
+                    for key in keys], [len(dates_) for dates_ in dates]))
+        return merged
+
+    def _series_index(self):
+        # a streamed message can only be read once, so it is loaded whole
+        if self._index is None:
+            if self._keys is None and self.tree is not None:
+                elements = list(self._series_elements())
+                keys = []
+                for element in elements:
+                    key, _ = self._series_key(element)
+                    if self._dimensions is None:
+                        self._dimensions = list(key)
+                    keys.append(tuple(key.values()))
+                if self._dimensions is None:
+                    self._dimensions = []
+                self._elements = elements
+            else:
+                self._load()
+                keys = self._keys
+            self._index = dict((key, i) for i, key in enumerate(keys))
+        return self._index
+
+    @staticmethod
+    def _key(key):
+        # a key tuple, or its codes joined by dots as in M.USD.EUR
+        return tuple(key.split('.')) if isinstance(key, str) else key
+
+    def keys(self, **dimensions):
+        # series keys in message order, only those whose codes match when
+        # dimensions give a code or a list of codes per dimension
+        index = self._series_index()
+        positions = []
+        for name, codes in dimensions.items():
+            if name not in self._dimensions:
+                raise ValueError("Unknown dimension {}".format(name))
+            positions.append((self._dimensions.index(name),
+                set(codes) if isinstance(codes, (list, tuple, set))
+                else {codes}))
+        return [key for key in index
+                if all(key[i] in codes for i, codes in positions)]
+
+    def __iter__(self):
+        return iter(self._series_index())
+
+    def __len__(self):
+        return len(self._series_index())
+
+    def __contains__(self, key):
+        return self._key(key) in self._series_index()
+
+    def _series_columns(self, positions):
+        # codes, dates, values and attributes of the series at positions
+        if self._keys is not None:
+            slices = [slice(self._offsets[i], self._offsets[i + 1])
+                    for i in positions]
+            return ([self._codes[i] for i in positions],
+                    [self._dates[slice_] for slice_ in slices],
+                    [self._values[slice_] for slice_ in slices],
+                    dict((name, [column[slice_] for slice_ in slices])
+                        for name, column in self._attributes.items()))
+        return _collect_series(self._series(self._elements[i])
+                for i in positions)[2:]
+
+    def __getitem__(self, key):
+        # codes and observations of one series, as in time_series
+        key = self._key(key)
+        i = self._series_index()[key]
+        if self._time_series is not None:
+            return self._time_series[key]
+        if key not in self._materialized:
+            codes, dates, values, _ = self._series_columns([i])
+            self._materialized[key] = (codes[0], pandas.Series(values[0],
+                index=pandas.DatetimeIndex(dates[0])))
+        return self._materialized[key]
+
+    def select(self, **dimensions):
+        # a Data holding the series matching the dimension codes, as for
+        # keys; observations are only read for these series
+        keys = self.keys(**dimensions)
+        index = self._series_index()
+        selected = Data(None, stats=self.stats)
+        selected._assign(self._dimensions, keys,
+                *self._series_columns([index[key] for key in keys]))
+        return selected
+
+    @property
+    def dimensions(self):
+        self._series_index()
+        return self._dimensions
 
     @property
     def time_series(self):
-        if not self._time_series:
+        if self._time_series is None:
             self._time_series = {}
-
-            for group  in self.tree.iterfind(".//generic:Group",
-                    namespaces=self.tree.nsmap):
-                for series in group.iterfind(".//generic:Series",
-                        namespaces=self.tree.nsmap):
-                    codes = {}
-                    for key in series.iterfind(".//generic:Value",
-                            namespaces=self.tree.nsmap):
-                        codes[key.get('concept')] = key.get('value')
-                    time_series_ = []
-                    for observation in series.iterfind(".//generic:Obs",
-                            namespaces=self.tree.nsmap):
-                        dimensions = observation.xpath(".//generic:Time",
-                                namespaces=self.tree.nsmap)
-                        dimension = dimensions[0].text 
-                        dimension = date_parser(dimension, codes['FREQ'])
-                        values = observation.xpath(".//generic:ObsValue",
-                                namespaces=self.tree.nsmap)
-                        value = values[0].values()
-                        value = value[0]
-                        observation_status = 'A'
-                        for attribute in \
-                                observation.iterfind(".//generic:Attributes",
-                                        namespaces=self.tree.nsmap):
-                                    for observation_status_ in \
-                                            attribute.xpath(
-                                                    ".//generic:Value[@concept='OBS_STATUS']",
-                                                    namespaces=self.tree.nsmap):
-                                                if observation_status_ is not None:
-                                                    observation_status \
-                                                            = observation_status_.get('value')
-                        time_series_.append((dimension, value, observation_status))
-                    time_series_.sort()
-                    dates = numpy.array(
-                            [observation[0] for observation in time_series_])
-                    values = numpy.array(
-                            [observation[1] for observation in time_series_])
-                    time_series_ = pandas.Series(values, index=dates)
-                    self._time_series[str(uuid.uuid1())] = (codes, time_series_)
+            for key, codes, dates, values, _ in self._slices():
+                time_series_ = pandas.Series(values,
+                        index=pandas.DatetimeIndex(dates))
+                self._time_series[key] = (codes, time_series_)
         return self._time_series
 
-class Wsdl(object): 
+    def to_frame(self, labels=None):
+        # long format, one row per observation; labels maps dimensions to
+        # a CodeIndex (or any code to label mapping) whose labels replace
+        # the codes of that dimension
+        self._load()
+        lengths = numpy.diff(self._offsets)
+        frame = {}
+        for i, dimension in enumerate(self._dimensions):
+            codes = pandas.Categorical([key[i] for key in self._keys])
+            categories = codes.categories
+            positions = codes.codes
+            if labels is not None and dimension in labels:
+                # only the categories are relabelled, never the rows
+                categories, relabelled = numpy.unique(numpy.array(
+                    [labels[dimension].get(code) or code
+                        for code in categories], dtype=object),
+                    return_inverse=True)
+                positions = relabelled[positions]
+            frame[dimension] = pandas.Categorical.from_codes(
+                    numpy.repeat(positions, lengths), categories)
+        frame['TIME_PERIOD'] = self._dates
+        frame['OBS_VALUE'] = self._values
+        frame.update(self._attributes)
+        return pandas.DataFrame(frame)
+
+    def to_wide(self):
+        # one column per series key, indexed by the union of periods
+        frame = self.to_frame()
+        return frame.set_index(self.dimensions + ['TIME_PERIOD'])[
+                'OBS_VALUE'].unstack(self.dimensions)
+
+class CompactData(Data):
+    # Compact (SDMX-ML 2.0) and StructureSpecific (2.1) data messages keep
+    # codes and observations in attributes of Series and Obs elements;
+    # components of the key family tell dimensions from attributes
+    def __init__(self, SDMXML, components=None, stats=None):
+        Data.__init__(self, SDMXML, stats=stats)
+        self.components = _components(components)
+
+    @classmethod
+    def from_file(cls, path, components=None, stats=None):
+        data = cls(open_source(path), components, stats=stats)
+        data._owned = True
+        return data
+
+    @classmethod
+    def from_bytes(cls, content, components=None, stats=None):
+        data = cls(open_source(content), components, stats=stats)
+        data._owned = True
+        return data
+
+    def _series_elements(self):
+        return self.tree.iter('{*}Series')
+
+    def _series_key(self, series):
+        attributes = dict(series.attrib)
+        if self.components is None:
+            # without the key family every series attribute is taken as
+            # a dimension
+            return attributes, {}
+        key = dict((dimension, attributes.pop(dimension, None))
+                for dimension, _ in self.components['dimensions'])
+        return key, attributes
+
+    def _series(self, series):
+        key, attributes = self._series_key(series)
+        if self.components is not None:
+            time_ = self.components['time']
+            measure = self.components['measure']
+        else:
+            time_ = 'TIME_PERIOD'
+            measure = 'OBS_VALUE'
+        namespace = lxml.etree.QName(series).namespace
+        nsmap = {'data': namespace} if namespace else {}
+        obs = 'data:Obs' if namespace else 'Obs'
+        observations = _xpath('count(%s)' % obs, nsmap)(series)
+        dimensions = _xpath('%s/@%s' % (obs, time_), nsmap)(series)
+        values = _xpath('%s/@%s' % (obs, measure), nsmap)(series)
+        first = series.find(lxml.etree.QName(namespace, 'Obs').text
+                if namespace else 'Obs')
+        names = [name for name in first.attrib
+                if name not in (time_, measure)] if first is not None \
+                        else []
+        observation_attributes = dict((name, _xpath('%s/@%s' % (obs, name),
+            nsmap)(series)) for name in names)
+        # whole columns line up when every observation carries the same
+        # attributes as the first one
+        if len(dimensions) == len(values) == observations \
+                and _xpath('count(%s/@*)' % obs, nsmap)(series) \
+                    == observations * (2 + len(names)) \
+                and all(len(column) == observations
+                    for column in observation_attributes.values()):
+            return key, attributes, dimensions, values, observation_attributes
+        dimensions = []
+        values = []
+        observation_attributes = {}
+        for i, observation in enumerate(_xpath(obs, nsmap)(series)):
+            dimensions.append(observation.get(time_))
+            values.append(observation.get(measure))
+            for name, value in observation.attrib.items():
+                if name not in (time_, measure):
+                    observation_attributes.setdefault(name,
+                            [None] * i).append(value)
+            for column in observation_attributes.values():
+                if len(column) == i:
+                    column.append(None)
+        return key, attributes, dimensions, values, observation_attributes
+
+
+class Wsdl(_Structure): 
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._wsdldata = None
     @property
     def wsdldata(self):  
-        if not self._wsdldata:
+        if self._wsdldata is None:
             self._wsdldata = {}
-            for message in self.tree.iterfind(".//xsd:schema",namespaces={'xsd':self.tree.nsmap['xsd']}):
-                for part in  message.iterfind('.//xsd:import',
-                        namespaces={'xsd':self.tree.nsmap['xsd']}):
+            xsd = _namespace(self.tree, 'xsd')
+            for message in self.tree.iter(xsd.schema):
+                for part in message.iter(xsd.path('import')):
                     namespace = part.get('namespace')
                     schemalocation= part.get('schemaLocation')
                     self._wsdldata[namespace] = (namespace,schemalocation)
         return self._wsdldata
 
-class Concept(object):  
+class Concept(_Structure):  
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._concept = None
@@ -161,48 +2090,71 @@ class Concept(object):
     @property
     def conceptdata(self):  
 
-        if not self._concept:
+        if self._concept is None:
             self._concept = {}
-            for concept in self.tree.iterfind(".//structure:Concept",
-                    namespaces=self.tree.nsmap):
+            structure = _namespace(self.tree, 'structure')
+            for concept in _xpath('.//structure:Concept',
+                    self.tree.nsmap)(self.tree):
                 id = concept.get('id')
                 agencyID = concept.get('agencyID')
                 version = concept.get('version')
-                name = concept.xpath('.//structure:Name', namespaces=self.tree.nsmap)[0].text
+                name = concept.findtext(structure.Name)
                 self._concept[id] = (agencyID, version, name)
         return self._concept
 
 
-class Keyfamily(object): 
+class Keyfamily(_Structure): 
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._codes = None
+        self._index = None
+        self._components = None
+
+    @property
+    def components(self):
+        # {keyfamily id: {'dimensions': [(concept, codelist), ...],
+        # 'time': concept, 'measure': concept,
+        # 'attributes': [(concept, codelist, attachment level), ...]}}
+        if self._components is None:
+            self._components = {}
+            structure = _namespace(self.tree, 'structure')
+            for keyfamily in _xpath(
+                    './/message:KeyFamilies/structure:KeyFamily',
+                    self.tree.nsmap)(self.tree):
+                components = keyfamily.find(structure.Components)
+                if components is None:
+                    continue
+                time_ = components.find(structure.TimeDimension)
+                measure = components.find(structure.PrimaryMeasure)
+                self._components[keyfamily.get('id')] = {
+                    'dimensions': [(dimension.get('conceptRef'),
+                        dimension.get('codelist')) for dimension in
+                        components.iterchildren(structure.Dimension)],
+                    'time': time_.get('conceptRef')
+                        if time_ is not None else 'TIME_PERIOD',
+                    'measure': measure.get('conceptRef')
+                        if measure is not None else 'OBS_VALUE',
+                    'attributes': [(attribute.get('conceptRef'),
+                        attribute.get('codelist'),
+                        attribute.get('attachmentLevel')) for attribute in
+                        components.iterchildren(structure.Attribute)],
+                    }
+        return self._components
 
     @property
     def codes(self):
-        if not self._codes:
-            self._codes = {}
-            codelists = self.tree.xpath(".//message:CodeLists",
-                    namespaces=self.tree.nsmap)
-            for codelists_ in codelists:
-                for codelist in codelists_.iterfind(".//structure:CodeList",
-                        namespaces=self.tree.nsmap):
-                    name = codelist.xpath('.//structure:Name', namespaces=self.tree.nsmap)
-                    name = name[0]
-                    name = name.text
-                    code = []
-                    for code_ in codelist.iterfind(".//structure:Code",
-                            namespaces=self.tree.nsmap):
-                        code_key = code_.get('value')
-                        code_name = code_.xpath('.//structure:Description',
-                                namespaces=self.tree.nsmap)
-                        code_name = code_name[0]
-                        code.append((code_key,code_name.text))
-                    self._codes[name] = code
+        if self._codes is None:
+            self._codes = _codelists(self.tree)
         return self._codes
 
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = _code_indexes(self.tree)
+        return self._index
+
 
-class Categoryscheme(object): 
+class Categoryscheme(_Structure): 
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._category = None
@@ -210,130 +2162,627 @@ class Categoryscheme(object):
 
     @property
     def codes(self):
-        if not self._category:
+        if self._category is None:
             self._category = {}
-            codelists = self.tree.xpath(".//message:CategorySchemes",
-                    namespaces=self.tree.nsmap)
-            for codelists_ in codelists:
-                for codelist in codelists_.iterfind(".//structure:CategoryScheme",
-                        namespaces=self.tree.nsmap):
-                    name = codelist.xpath('.//structure:Name', namespaces=self.tree.nsmap)
-                    name = name[0]
-                    name = name.text
-                    code = []
-                    for code_ in codelist.iterfind(".//structure:Category",
-                            namespaces=self.tree.nsmap):
-                        code_key = code_.get('id')
-                        code_name = code_.xpath('.//structure:Name',
-                                namespaces=self.tree.nsmap)
-                        code_name = code_name[0]
-                        dataflowref=[]
-                        for dataflow in code_.iterfind(".//structure:DataflowRef", namespaces=self.tree.nsmap): #iterchilren TODO
-                            if dataflow is not None:
-                                dataflowID = dataflow.xpath('.//structure:DataflowID', namespaces=self.tree.nsmap)[0].text
-                                agencyID = dataflow.xpath('.//structure:AgencyID', namespaces=self.tree.nsmap)[0].text
-                                version = dataflow.xpath('.//structure:Version', namespaces=self.tree.nsmap)[0].text
-                                dataflowref.append((agencyID, version,
-                                     dataflowID))
-                                code.append((code_key,code_name.text,dataflowref))
-                    self._category[name] = code
+            structure = _namespace(self.tree, 'structure')
+            for codelist in _xpath(
+                    './/message:CategorySchemes/structure:CategoryScheme',
+                    self.tree.nsmap)(self.tree):
+                name = codelist.findtext(structure.Name)
+                code = []
+                # categories nest, each one lists its own dataflows
+                for code_ in codelist.iter(structure.Category):
+                    code_key = code_.get('id')
+                    code_name = code_.findtext(structure.Name)
+                    dataflowref=[]
+                    for dataflow in code_.iterchildren(structure.DataflowRef):
+                        dataflowID = dataflow.findtext(structure.DataflowID)
+                        agencyID = dataflow.findtext(structure.AgencyID)
+                        version = dataflow.findtext(structure.Version)
+                        dataflowref.append((agencyID, version,
+                             dataflowID))
+                        code.append((code_key,code_name,dataflowref))
+                self._category[name] = code
         return self._category
 
 
-class Organisationschemes(object): 
+class Organisationschemes(_Structure): 
     def __init__(self, SDMXML):
         self.tree = SDMXML
         self._organisationscheme = None
 
     @property
     def codes(self):
-        if not self._organisationscheme:
+        if self._organisationscheme is None:
             self._organisationscheme = {}
-            codelists = self.tree.xpath(".//message:OrganisationSchemes",
-                    namespaces=self.tree.nsmap)
-            for codelists_ in codelists:
-                for codelist in codelists_.iterfind(".//structure:CodeList",
-                        namespaces=self.tree.nsmap):
-                    name = codelist.xpath('.//structure:Name', namespaces=self.tree.nsmap)
-                    name = name[0]
-                    name = name.text
-                    code = []
-                    for code_ in codelist.iterfind(".//structure:Agency",
-                            namespaces=self.tree.nsmap):
-                        code_key = code_.get('id')
-                        code_name = code_.xpath('.//structure:Name',
-                                namespaces=self.tree.nsmap)
-                        code_name = code_name[0]
-                        code.append((code_key,code_name.text))
-                    self._organisationscheme[name] = code
+            structure = _namespace(self.tree, 'structure')
+            for codelist in _xpath(
+                    './/message:OrganisationSchemes/structure:OrganisationScheme',
+                    self.tree.nsmap)(self.tree):
+                name = codelist.findtext(structure.Name)
+                code = []
+                for code_ in codelist.iter(structure.Agency):
+                    code_key = code_.get('id')
+                    code_name = code_.findtext(structure.Name)
+                    code.append((code_key,code_name))
+                self._organisationscheme[name] = code
         return self._organisationscheme
 
 
+class QueryPlanner(object):
+    def __init__(self, window=365, keys_per_chunk=20, min_window=7,
+            max_window=50 * 365, target_observations=200000,
+            target_seconds=10):
+        # window is the number of days a chunk spans, adapted to what the
+        # server returned for the chunks already fetched
+        self.window = window
+        self.keys_per_chunk = keys_per_chunk
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_observations = target_observations
+        self.target_seconds = target_seconds
+        self._lock = threading.Lock()
+
+    def key_chunks(self, keys):
+        return [keys[i:i + self.keys_per_chunk]
+                for i in range(0, len(keys), self.keys_per_chunk)]
+
+    def next_window(self, start, end):
+        stop = start + datetime.timedelta(days=int(self.window) - 1)
+        return start, min(stop, end)
+
+    def observe(self, start, stop, observations, seconds):
+        days = (stop - start).days + 1
+        if observations:
+            window = self.target_observations * days / float(observations)
+        else:
+            window = 2 * days
+        if seconds > 0:
+            window = min(window, self.target_seconds * days / seconds)
+        with self._lock:
+            # geometric step toward the estimate to damp noisy chunks
+            window = (self.window * window) ** 0.5
+            self.window = min(max(window, self.min_window), self.max_window)
+
+    def split(self, chunk):
+        keys, start, stop = chunk
+        days = (stop - start).days + 1
+        if days >= 2 * self.min_window:
+            with self._lock:
+                self.window = max(self.window / 2., self.min_window)
+            middle = start + datetime.timedelta(days=days // 2 - 1)
+            return [(keys, start, middle),
+                    (keys, middle + datetime.timedelta(days=1), stop)]
+        if len(keys) > 1:
+            return [(keys[:len(keys) // 2], start, stop),
+                    (keys[len(keys) // 2:], start, stop)]
+        return None
+
+
+class KeyExpression(object):
+    # key of a data query over the dimensions of a key family, in their
+    # DSD order: D.USD+JPY.EUR.SP00.A, alternative codes joined by + and
+    # an empty position matching any code
+    def __init__(self, keyfamily, codelists=None, **dimensions):
+        # dimensions map to a code, a list of codes or codes joined by +,
+        # None or '*' for any code; codelists ({id: CodeIndex}) default to
+        # those of the key family message
+        components = _components(keyfamily)
+        if components is None:
+            raise ValueError("Key family without components")
+        self.dimensions = [dimension for dimension, _
+                in components['dimensions']]
+        self.codelists = dict(components['dimensions'])
+        if codelists is None:
+            codelists = dict((index.id, index) for index
+                    in keyfamily.index.values()) \
+                            if isinstance(keyfamily, Keyfamily) else {}
+        self._indexes = codelists
+        self.codes = {}
+        for name, codes in dimensions.items():
+            if name not in self.codelists:
+                raise ValueError("Unknown dimension {}".format(name))
+            if isinstance(codes, str):
+                codes = codes.split('+')
+            if codes is None or '*' in codes:
+                continue
+            self.codes[name] = list(codes)
+
+    def invalid(self):
+        # {dimension: codes its codelist does not hold}, dimensions whose
+        # codelist is not known are not checked
+        invalid = {}
+        for name, codes in self.codes.items():
+            index = self._indexes.get(self.codelists[name])
+            if index is not None and index.invalid(codes):
+                invalid[name] = index.invalid(codes)
+        return invalid
+
+    def validate(self):
+        invalid = self.invalid()
+        if invalid:
+            raise ValueError("Invalid codes {}".format(invalid))
+        return self
+
+    def __str__(self):
+        return '.'.join('+'.join(urllib.parse.quote(code, safe='')
+            for code in self.codes.get(name, ()))
+            for name in self.dimensions)
+
+    def params(self):
+        # the key as query parameters of the SDMX 2.0 data resources, a
+        # parameter per dimension given codes, in DSD order
+        return [(name, '+'.join(self.codes[name]))
+                for name in self.dimensions if name in self.codes]
+
+
+class StructureRegistry(object):
+    # dataflows, key families, codelists, concepts and category schemes of
+    # an agency, loaded together and linked through their references:
+    # dataflow -> key family -> dimensions -> concepts and codelists
+    snapshot_version = 1
+
+    def __init__(self, agencyID=None):
+        self.agencyID = agencyID
+        # as given by Dataflows.all_dataflows
+        self.dataflows = {}
+        # {keyfamily id: Keyfamily.components entry}
+        self.keyfamilies = {}
+        # {codelist id: CodeIndex}
+        self.codelists = {}
+        # as given by Concept.conceptdata
+        self.concepts = {}
+        # as given by Categoryscheme.codes
+        self.categoryschemes = {}
+        self._categories = None
+
+    @classmethod
+    def fetch(cls, client, max_workers=None):
+        # every structure of the client's agency, requested side by side
+        registry = cls(client.agencyID)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers or client.max_connections) as executor:
+            futures = [executor.submit(query) for query in (
+                client.dataflow, client.data_keyfamily, client.data_concept,
+                client.data_categoryscheme)]
+        for future in futures:
+            registry.add(future.result())
+        return registry
+
+    def add(self, structure):
+        # a parsed Dataflows, Keyfamily, Codelist, Concept or
+        # Categoryscheme message
+        if isinstance(structure, Dataflows):
+            self.dataflows.update(structure.all_dataflows)
+        elif isinstance(structure, Keyfamily):
+            self.keyfamilies.update(structure.components)
+            self.codelists.update((index.id, index)
+                    for index in structure.index.values())
+        elif isinstance(structure, Codelist):
+            self.codelists.update((index.id, index)
+                    for index in structure.index.values())
+        elif isinstance(structure, Concept):
+            self.concepts.update(structure.conceptdata)
+        elif isinstance(structure, Categoryscheme):
+            self.categoryschemes.update(structure.codes)
+            self._categories = None
+        else:
+            raise ValueError("Not a structure {}".format(
+                type(structure).__name__))
+        return self
+
+    def keyfamily(self, flowRef):
+        # components of the key family of a dataflow, or of a key family
+        # given by id
+        dataflow = self.dataflows.get(flowRef)
+        keyfamily = self.keyfamilies.get(dataflow[3]
+                if dataflow is not None else flowRef)
+        if keyfamily is None:
+            raise ValueError("Unknown dataflow {}".format(flowRef))
+        return keyfamily
+
+    def dimensions(self, flowRef):
+        # [(dimension, concept name, CodeIndex)] in key order, None for
+        # what the registry does not hold
+        return [(dimension, self.concepts.get(dimension,
+            (None, None, None))[2], self.codelists.get(codelist))
+            for dimension, codelist in self.keyfamily(flowRef)['dimensions']]
+
+    def codelist(self, flowRef, dimension):
+        for dimension_, codelist in self.keyfamily(flowRef)['dimensions']:
+            if dimension_ == dimension:
+                return self.codelists.get(codelist)
+        raise ValueError("Unknown dimension {}".format(dimension))
+
+    def categories(self, flowRef):
+        # [(category scheme, category id, category name)] listing the
+        # dataflow
+        if self._categories is None:
+            self._categories = {}
+            for scheme, categories in self.categoryschemes.items():
+                for id, name, dataflows in categories:
+                    for _, _, dataflow in dataflows:
+                        self._categories.setdefault(dataflow, []).append(
+                                (scheme, id, name))
+        return self._categories.get(flowRef, [])
+
+    def key(self, flowRef, **dimensions):
+        # KeyExpression over the dataflow, checked against the registry
+        # codelists
+        return KeyExpression(self.keyfamily(flowRef),
+                codelists=self.codelists, **dimensions)
+
+    def save(self, path):
+        # a pickle of the plain structures; only load snapshots this
+        # process or a trusted one wrote
+        state = {
+                'version': self.snapshot_version,
+                'agencyID': self.agencyID,
+                'dataflows': self.dataflows,
+                'keyfamilies': self.keyfamilies,
+                'codelists': self.codelists,
+                'concepts': self.concepts,
+                'categoryschemes': self.categoryschemes,
+                }
+        with open(path + '.tmp', 'wb') as file_:
+            pickle.dump(state, file_, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file_:
+            state = pickle.load(file_)
+        if state.get('version') != cls.snapshot_version:
+            raise ValueError("Unsupported snapshot version {}".format(
+                state.get('version')))
+        registry = cls(state['agencyID'])
+        for name in ('dataflows', 'keyfamilies', 'codelists', 'concepts',
+                'categoryschemes'):
+            setattr(registry, name, state[name])
+        return registry
+
+
+# data message resources by format
+DATA_FORMATS = {
+        'generic': 'GenericData',
+        'compact': 'CompactData',
+        'structurespecific': 'StructureSpecificData',
+        # negotiated through MEDIA_TYPES, GenericData being the fallback
+        'csv': 'GenericData',
+        'json': 'GenericData',
+        }
+
+
+def _overloaded(error):
+    # a chunk failing for its size, worth trying again as smaller chunks,
+    # rather than one the service refuses whatever its size
+    if isinstance(error, StatusError):
+        return error.status_code == 413 or error.status_code >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError,
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.Timeout))
+
+
+def _result(future):
+    try:
+        return future.result()
+    except Exception as error:
+        return error
+
+
 class SDMX_REST(object): 
 
-    def __init__(self, sdmx_url, agencyID):
+    def __init__(self, sdmx_url, agencyID, transport=None, cache=None,
+            max_connections=4, stats=None, registry=None, formats=None,
+            results=None):
         self.sdmx_url = sdmx_url
         self.agencyID = agencyID
-        self._dataflow = None
-        self._organisationscheme = None
-        self._wsdl = None
+        # DATA_FORMATS the service answers, None when not known
+        self.formats = formats
+        self.transport = transport if transport is not None else Transport()
+        # optional HTTPCache for structural queries
+        self.cache = cache
+        # concurrent requests this client sends to its host; a streamed
+        # data query holds its slot only until the answer starts, its
+        # body is read as the Data is used, which may never happen
+        self._connections = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+        # Stats collecting per-phase timings of every query of this client
+        self.stats = stats if stats is not None else Stats()
+        # optional StructureRegistry answering key family lookups locally
+        self.registry = registry
+        # ResultCache of parsed structures, which may be shared by clients
+        self.results = results if results is not None else ResultCache()
+
+    def _query(self, url, stream=False, resource=None):
+        if resource is not None and self.cache is not None:
+            content = self.cache.fetch(url, resource, self.transport,
+                    stats=self.stats)
+            with self.stats.phase('tree'):
+                return parse_xml(content)
+        return query_rest(url, stream=stream, transport=self.transport,
+                stats=self.stats)
+
+    def _structure(self, structure, url, resource, stored=True):
+        # structure parsed from the response to url, through the result
+        # cache and, when stored, the HTTP cache
+        def query():
+            with self._connections:
+                return structure(self._query(url,
+                    resource=resource if stored else None))
+        return self.results.get((structure.__name__, url), resource,
+                query, stats=self.stats)
     
     @property
     def data_wsdl(self): 
-        if not self._wsdl:
-            resource = 'services'
-            flowRef= 'SDMXQuery?wsdl'
-            url = (self.sdmx_url + '/'
-            + resource + '/'
-            + flowRef )
-            self._wsdl = Wsdl(query_rest(url))    
-        return self._wsdl
+        resource = 'services'
+        flowRef= 'SDMXQuery?wsdl'
+        url = (self.sdmx_url + '/'
+        + resource + '/'
+        + flowRef )
+        return self._structure(Wsdl, url, resource, stored=False)
 
 
     def dataflow(self,resourceID = None): 
-        if not self._dataflow:
-            if resourceID is not None :
-                resource = 'Dataflow'
-                url = (self.sdmx_url+'/' 
-                   + resource + '/'
-                   + resourceID)             
-                self._dataflow = Dataflows(query_rest(url))
-            else :
-                resource = 'Dataflow'  
-                url = (self.sdmx_url + '/'
-                   + resource  )
-                self._dataflow = Dataflows(query_rest(url))    
-        return self._dataflow
+        resource = 'Dataflow'
+        if resourceID is not None :
+            url = (self.sdmx_url+'/' 
+               + resource + '/'
+               + resourceID)             
+        else :
+            url = (self.sdmx_url + '/'
+               + resource  )
+        return self._structure(Dataflows, url, resource)
 
     @property
     def data_organisationscheme(self): 
-        if not self._organisationscheme:
-            resource = 'OrganisationScheme'  
-            url = (self.sdmx_url + '/'
-            + resource  )
-            self._organsiationscheme = Organisationschemes(query_rest(url))    
-        return self._organisationscheme
+        resource = 'OrganisationScheme'  
+        url = (self.sdmx_url + '/'
+        + resource  )
+        return self._structure(Organisationschemes, url, resource,
+                stored=False)
 
     def data_extraction(self, flowRef, freq, key,  startperiod=None,
-            endperiod=None):
-        resourcetype = 'GenericData'
-        resource ='dataflow'
+            endperiod=None, stream=False, updatedafter=None,
+            processes=None, format='generic', keyfamily=None):
+        params = [('dataflow', flowRef)]
         if freq is not None and startperiod is not None and endperiod is not None :
-            query = (self.sdmx_url + '/'
-                + resourcetype + '?'
-                + resource + '='
-                + flowRef + '&'
-                + 'FREQ=' +  freq 
-                + '&CURRENCY='+ key
-                + '&startTime=' + startperiod
-                + '&endTime=' + endperiod)
+            params += [('FREQ', freq), ('CURRENCY', key),
+                    ('startTime', startperiod), ('endTime', endperiod)]
+        if updatedafter is not None:
+            params.append(('updatedAfter', updatedafter))
+        url = (self.sdmx_url + '/'
+            + DATA_FORMATS[format] + '?'
+            + urllib.parse.urlencode(params))
+        return self._data(url, flowRef, stream, processes, format, keyfamily)
+
+    def data_query(self, flowRef, startperiod=None, endperiod=None,
+            updatedafter=None, stream=False, processes=None,
+            format='generic', keyfamily=None, validate=True, **dimensions):
+        # every series matching the codes of the dimensions in a single
+        # request, e.g. data_query('EXR', FREQ='D', CURRENCY=['USD', 'JPY'],
+        # CURRENCY_DENOM='EUR'); the key family of the flow, taken from
+        # the registry or fetched unless given, orders the dimensions and,
+        # with validate, the codes are checked against its codelists
+        # before anything is sent. The key goes out as the query parameters
+        # of the SDMX 2.0 resources, GenericData?dataflow=EXR&FREQ=D&...
+        codelists = None
+        if keyfamily is None and self.registry is not None \
+                and flowRef in self.registry.dataflows:
+            keyfamily = self.registry.keyfamily(flowRef)
+            codelists = self.registry.codelists
+        if keyfamily is None:
+            keyfamily = self.data_keyfamily(flowRef)
+        key = KeyExpression(keyfamily, codelists, **dimensions)
+        if validate:
+            key.validate()
+        params = [('dataflow', flowRef)] + key.params() + [(name, value)
+                for name, value in (('startTime', startperiod),
+                    ('endTime', endperiod), ('updatedAfter', updatedafter))
+                if value is not None]
+        url = (self.sdmx_url + '/'
+            + DATA_FORMATS[format] + '?'
+            + urllib.parse.urlencode(params))
+        return self._data(url, flowRef, stream, processes, format, keyfamily)
+
+    def _data(self, url, flowRef, stream, processes, format, keyfamily):
+        # format is one of DATA_FORMATS; compact and structurespecific
+        # messages are read with the key family of the flow, fetched
+        # unless given as keyfamily; csv and json are asked for through
+        # the Accept header, whatever the server answers with is read
+        if self.formats is not None and format not in self.formats:
+            if format not in MEDIA_TYPES:
+                raise ValueError("Format {} not offered by {}".format(format,
+                    self.agencyID))
+            # the GenericData a server without them would answer anyway
+            format = 'generic'
+        if format != 'generic' and processes is not None:
+            raise ValueError("Parallel parsing needs GenericData")
+        if format in MEDIA_TYPES:
+            with self._connections:
+                content_type, content = query_media(url, format,
+                        transport=self.transport, stats=self.stats)
+            return Data.from_response(content_type, content, keyfamily,
+                    stats=self.stats)
+        if format != 'generic':
+            if keyfamily is None:
+                keyfamily = self.data_keyfamily(flowRef)
+            with self._connections:
+                data = CompactData(self._query(url, stream=stream),
+                        keyfamily, stats=self.stats)
+        elif processes is not None:
+            with self._connections:
+                content = query_bytes(url, transport=self.transport,
+                        stats=self.stats)
+            return Data.parallel(content, processes, stats=self.stats)
         else:
-            query = (self.sdmx_url + '/'
-                + resourcetype + '?'
-                + resource + '='
-                + flowRef)
-        url = (query)
-        return Data(query_rest(url))
+            with self._connections:
+                data = Data(self._query(url, stream=stream), stats=self.stats)
+        # a streamed body is closed once read, or when its reading stops
+        # halfway, which gives its connection back
+        data._owned = stream
+        return data
+
+    def data_refresh(self, store, flowRef, freq, key, startperiod=None,
+            endperiod=None, mode='updatedAfter'):
+        # fetch only what changed since the series of the query were last
+        # stored, either through updatedAfter or from the last stored
+        # period onward, and merge it into the SeriesStore; codes without
+        # any stored series get their whole history in a query of their own
+        fetched = datetime.datetime.now(datetime.timezone.utc)
+        codes = key.split('+')
+        missing = [code for code in codes if store.since(flowRef,
+            FREQ=freq, CURRENCY=code)[0] is None]
+        codes = [code for code in codes if code not in missing]
+        since, last = store.since(flowRef, FREQ=freq, CURRENCY=codes)
+        if missing:
+            data = self._refresh_data(flowRef, freq, missing, startperiod,
+                    endperiod)
+            store.update(flowRef, data, fetched, FREQ=freq, CURRENCY=missing)
+        if codes:
+            if mode == 'updatedAfter':
+                data = self._refresh_data(flowRef, freq, codes, startperiod,
+                        endperiod, updatedafter=since)
+            else:
+                if endperiod is None:
+                    endperiod = fetched.date().isoformat()
+                # codes a query found nothing for, from the day of that query
+                data = self._refresh_data(flowRef, freq, codes,
+                        last or since[:10], endperiod)
+            store.update(flowRef, data, fetched, FREQ=freq, CURRENCY=codes)
+        return store.load(flowRef)
+
+    def _refresh_data(self, flowRef, freq, codes, startperiod=None,
+            endperiod=None, updatedafter=None):
+        # unlike data_extraction, the frequency and the key go out
+        # whatever periods are given
+        params = [('dataflow', flowRef), ('FREQ', freq),
+                ('CURRENCY', '+'.join(codes))] + [(name, value)
+                for name, value in (('startTime', startperiod),
+                    ('endTime', endperiod), ('updatedAfter', updatedafter))
+                if value is not None]
+        url = (self.sdmx_url + '/'
+            + DATA_FORMATS['generic'] + '?'
+            + urllib.parse.urlencode(params))
+        return self._data(url, flowRef, False, None, 'generic', None)
+
+    def data_extraction_many(self, specs, max_workers=None,
+            as_completed=False):
+        # specs are data_extraction argument tuples
+        # (flowRef, freq, key, startperiod, endperiod); a failing spec
+        # gives its exception in place of the Data without stopping the rest
+        specs = list(specs)
+        if max_workers is None:
+            # parsing runs outside the connection limit, so keep a few
+            # more workers than connections to overlap it with transfers
+            max_workers = 2 * self.max_connections
+
+        def extract(spec):
+            data = self.data_extraction(*spec)
+            data._load()
+            return data
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        futures = dict((executor.submit(extract, spec), index)
+                for index, spec in enumerate(specs))
+        executor.shutdown(wait=False)
+        if as_completed:
+            return self._completed(futures)
+        concurrent.futures.wait(futures)
+        return [_result(future) for future in futures]
+
+    def data_extraction_split(self, flowRef, freq, keys, startperiod,
+            endperiod, planner=None, max_workers=None):
+        # fetch a long or wide query as planner-sized chunks of periods and
+        # keys, in parallel, and stitch the chunks back into one Data
+        if planner is None:
+            planner = QueryPlanner()
+        if max_workers is None:
+            max_workers = self.max_connections
+        if isinstance(keys, str):
+            keys = keys.split('+')
+        key_chunks = planner.key_chunks(list(keys))
+        cursor = pandas.Period(startperiod).start_time.date()
+        end = pandas.Period(endperiod).end_time.date()
+
+        def extract(chunk):
+            keys_, start, stop = chunk
+            started = time.perf_counter()
+            data = self.data_extraction(flowRef, freq, '+'.join(keys_),
+                    start.isoformat(), stop.isoformat())
+            data._load()
+            return data, time.perf_counter() - started
+
+        queue = collections.deque()
+        running = {}
+        results = []
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            while queue or running or cursor <= end:
+                while len(running) < max_workers:
+                    if not queue and cursor <= end:
+                        start, stop = planner.next_window(cursor, end)
+                        queue.extend((keys_, start, stop)
+                                for keys_ in key_chunks)
+                        cursor = stop + datetime.timedelta(days=1)
+                    if not queue:
+                        break
+                    chunk = queue.popleft()
+                    running[executor.submit(extract, chunk)] = chunk
+                done, _ = concurrent.futures.wait(running,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    chunk = running.pop(future)
+                    try:
+                        data, seconds = future.result()
+                    except (ValueError,
+                            requests.exceptions.RequestException) as error:
+                        # a 4xx is final, and leaves the window as it is
+                        chunks = planner.split(chunk) \
+                                if _overloaded(error) else None
+                        if chunks is None:
+                            failed.append(chunk + (error,))
+                        else:
+                            queue.extendleft(reversed(chunks))
+                        continue
+                    planner.observe(chunk[1], chunk[2],
+                            len(data._dates), seconds)
+                    results.append((chunk[1], data))
+        results.sort(key=lambda result: result[0])
+        data = Data.merge([data for _, data in results])
+        data.failed = failed
+        return data
+
+    def data_download(self, flowRef, path, format='generic', keyfamily=None,
+            progress=None, split=None):
+        # a whole dataflow downloaded to path, resumably, and read back
+        # from the file series by series; split holds the (freq, keys,
+        # startperiod, endperiod) of data_extraction_split, which gets the
+        # flow instead when the transfer breaks off and cannot be resumed
+        if format in MEDIA_TYPES:
+            raise ValueError("Download needs SDMX-ML, not {}".format(format))
+        if self.formats is not None and format not in self.formats:
+            raise ValueError("Format {} not offered by {}".format(format,
+                self.agencyID))
+        url = (self.sdmx_url + '/'
+            + DATA_FORMATS[format] + '?'
+            + urllib.parse.urlencode([('dataflow', flowRef)]))
+        with self._connections:
+            complete = download(url, path, transport=self.transport,
+                    stats=self.stats, progress=progress,
+                    restart=split is None)
+        if not complete:
+            return self.data_extraction_split(flowRef, *split)
+        if format != 'generic':
+            if keyfamily is None:
+                keyfamily = self.data_keyfamily(flowRef)
+            return CompactData.from_file(path, keyfamily, stats=self.stats)
+        return Data.from_file(path, stats=self.stats)
+
+    @staticmethod
+    def _completed(futures):
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], _result(future)
 
     def data_concept(self, flowRef=None):
         resource = 'Concept'
@@ -345,7 +2794,7 @@ class SDMX_REST(object):
         else :
             url = (self.sdmx_url + '/'
                + resource) 
-        return Concept(query_rest(url))
+        return self._structure(Concept, url, resource)
 
     def data_codelist(self, flowRef):
         resource = 'CodeList'
@@ -353,7 +2802,7 @@ class SDMX_REST(object):
                + resource + '/' 
                + flowRef+ '/'
                +self.agencyID)
-        return Codelist(query_rest(url))
+        return self._structure(Codelist, url, resource)
 
     def data_keyfamily(self, flowRef=None):
         resource = 'KeyFamily'
@@ -364,7 +2813,7 @@ class SDMX_REST(object):
         else :
             url = (self.sdmx_url + '/'
                + resource) 
-        return Keyfamily(query_rest(url))
+        return self._structure(Keyfamily, url, resource)
 
     def data_categoryscheme(self, flowRef=None):
         resource = 'CategoryScheme'
@@ -375,8 +2824,40 @@ class SDMX_REST(object):
         else :
             url = (self.sdmx_url + '/'
                + resource) 
-        return Categoryscheme(query_rest(url))
+        return self._structure(Categoryscheme, url, resource)
     
 
-ECB = SDMX_REST('http://sdw-ws.ecb.europa.eu','ECB')
+# SDMX web services by agency: base URL and the DATA_FORMATS they answer;
+# their clients are created on first use, as pysdmx.ECB or provider('ECB')
+PROVIDERS = {
+        'ECB': {'url': 'http://sdw-ws.ecb.europa.eu',
+            'formats': ('generic', 'compact')},
+        }
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def register_provider(agencyID, url, formats=None):
+    with _providers_lock:
+        PROVIDERS[agencyID] = {'url': url, 'formats': formats}
+        _providers.pop(agencyID, None)
+
+
+def provider(agencyID):
+    with _providers_lock:
+        client = _providers.get(agencyID)
+        if client is None:
+            if agencyID not in PROVIDERS:
+                raise ValueError("Unknown provider {}".format(agencyID))
+            entry = PROVIDERS[agencyID]
+            client = _providers[agencyID] = SDMX_REST(entry['url'],
+                    agencyID, formats=entry.get('formats'))
+        return client
+
+
+def __getattr__(name):
+    if name in PROVIDERS:
+        return provider(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
 
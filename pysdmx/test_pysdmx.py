@@ -0,0 +1,544 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Tests of pysdmx against synthetic SDMX-ML messages """
+
+import sys
+import json
+import time
+import datetime
+import threading
+import urllib.parse
+import concurrent.futures
+
+import pandas
+import pytest
+
+import benchmark
+import pysdmx
+
+
+@pytest.fixture
+def server():
+    with benchmark.StandInServer(series=10, observations=10,
+            structures=10) as server:
+        yield server
+
+
+def data(series=3, observations=5, frequencies='M'):
+    return pysdmx.Data(pysdmx.parse_xml(benchmark.generic_message(series,
+        observations, frequencies)))
+
+
+def data_frame(series=3, observations=5, frequencies='M'):
+    return data(series, observations, frequencies).to_frame()
+
+
+@pytest.mark.parametrize('frequency, periods, expected', [
+    ('A', ['2001', '2002'], ['2001-01-01', '2002-01-01']),
+    # sub-annual periods are stamped on their last month
+    ('S', ['2001-S1', '2001-S2'], ['2001-06-01', '2001-12-01']),
+    ('H', ['2001-H1', '2001-H2'], ['2001-06-01', '2001-12-01']),
+    ('Q', ['2001-Q1', '2001Q4'], ['2001-03-01', '2001-12-01']),
+    ('M', ['2001-01', '2001-12'], ['2001-01-01', '2001-12-01']),
+    # ISO weeks start on their Monday
+    ('W', ['2001-W01', '2004-W53'], ['2001-01-01', '2004-12-27']),
+    ('D', ['2001-02-03', '2004-02-29'], ['2001-02-03', '2004-02-29']),
+    ('B', ['2001-02-02', '2001-02-05'], ['2001-02-02', '2001-02-05']),
+    # timestamps and plain dates fall back to ISO 8601 parsing
+    ('D', ['2001-02-03T04:00:00', '2001-02-03T05:00:00'],
+        ['2001-02-03 04:00', '2001-02-03 05:00']),
+    ('N', ['2001-02-03T04:05', '2001-02-03T04:06'],
+        ['2001-02-03 04:05', '2001-02-03 04:06']),
+    ('A', ['2001-02-03', '2001-03-04'], ['2001-02-03', '2001-03-04']),
+    ])
+def test_time_index(frequency, periods, expected):
+    index = pysdmx.time_index(periods, frequency)
+    assert isinstance(index, pandas.DatetimeIndex)
+    assert list(index) == list(pandas.to_datetime(expected))
+    assert pysdmx.date_parser(periods[0], frequency) \
+            == index[0].to_pydatetime()
+
+
+def grouped_message(series=20, observations=5):
+    # the series of a generic message inside a sibling group
+    return benchmark.generic_message(series, observations, 'MQ').replace(
+            b'<generic:Series>', b'<generic:Group type="SiblingGroup">'
+            b'<generic:Series>', 1).replace(b'</message:DataSet>',
+            b'</generic:Group></message:DataSet>')
+
+
+def test_series_spans():
+    message = grouped_message()
+    declarations, spans = pysdmx._series_spans(message)
+    assert (b'generic', benchmark.GENERIC.encode()) in declarations
+    assert len(spans) == 20
+    for start, end in spans:
+        assert message[start:end].startswith(b'<generic:Series>')
+        assert message[start:end].endswith(b'</generic:Series>')
+    # no GenericData root, nothing to split
+    assert pysdmx._series_spans(benchmark.compact_message(3, 5)) == ([], [])
+    # a Series left open gives no spans rather than a broken one
+    assert pysdmx._series_spans(message[:spans[-1][1] - 5])[1] == []
+
+
+@pytest.mark.parametrize('message', [
+    benchmark.generic_message(20, 5, 'MQ'),
+    grouped_message(),
+    ])
+def test_parallel_reads_like_tree(message):
+    expected = pysdmx.Data(pysdmx.parse_xml(message)).to_frame()
+    assert pysdmx.Data.parallel(message, 2).to_frame().equals(expected)
+
+
+def test_parallel_falls_back_to_one_process():
+    # fewer series than two per process are parsed in this process
+    message = benchmark.generic_message(3, 5)
+    data = pysdmx.Data.parallel(message, 2)
+    assert data.tree is not None
+    assert data.to_frame().equals(pysdmx.Data(
+        pysdmx.parse_xml(message)).to_frame())
+
+
+@pytest.mark.parametrize('structure_specific', [False, True])
+def test_compact_reads_like_generic(structure_specific):
+    message = benchmark.compact_message(6, 12, 'MQD',
+            structure_specific=structure_specific)
+    data = pysdmx.CompactData(pysdmx.parse_xml(message),
+            benchmark.components())
+    assert data.to_frame().equals(data_frame(6, 12, 'MQD'))
+    assert data.keys(FREQ='Q') == [('Q', 'C0001', 'EUR'),
+            ('Q', 'C0004', 'EUR')]
+
+
+@pytest.mark.parametrize('format', ['compact', 'structurespecific'])
+def test_compact_extraction(server, format):
+    # the key family is fetched from the server when not given
+    client = pysdmx.SDMX_REST(server.url, 'ECB')
+    data = client.data_extraction('EXR', None, None, format=format)
+    assert isinstance(data, pysdmx.CompactData)
+    assert data.to_frame().equals(data_frame(10, 10))
+
+
+def test_csv_reads_like_generic():
+    message = benchmark.csv_message(6, 12, 'MQD')
+    expected = data_frame(6, 12, 'MQD')
+    assert pysdmx.Data.from_csv(message).to_frame().equals(expected)
+    assert pysdmx.Data.from_csv(message,
+            benchmark.components()).to_frame().equals(expected)
+    # rows in any order: series in the order they first come, each
+    # sorted by period
+    header, *rows = message.rstrip(b'\n').split(b'\n')
+    frame = pysdmx.Data.from_csv(b'\n'.join([header] + rows[::-1])
+            + b'\n').to_frame()
+    assert list(frame['CURRENCY'].unique()) == ['C%04d' % i
+            for i in range(5, -1, -1)]
+    assert frame.groupby('CURRENCY', observed=True)[
+            'TIME_PERIOD'].is_monotonic_increasing.all()
+    assert frame.sort_values(['CURRENCY', 'TIME_PERIOD'],
+            ignore_index=True).equals(expected)
+
+
+def test_json_reads_like_generic():
+    message = benchmark.json_message(6, 12, 'MQD')
+    assert pysdmx.Data.from_json(message).to_frame().equals(
+            data_frame(6, 12, 'MQD'))
+
+
+@pytest.mark.parametrize('content_type, resource', [
+    ('application/vnd.sdmx.data+csv;version=1.0.0', 'text/csv'),
+    ('application/json', 'application/json'),
+    ('text/xml', 'GenericData'),
+    ])
+def test_response_read_by_content_type(server, content_type, resource):
+    content = server.media.get(resource) or server.messages[resource]
+    assert pysdmx.Data.from_response(content_type,
+            content).to_frame().equals(data_frame(10, 10))
+
+
+@pytest.mark.parametrize('format', ['csv', 'json'])
+def test_media_extraction(server, format):
+    client = pysdmx.SDMX_REST(server.url, 'ECB')
+    assert client.data_extraction('EXR', None, None,
+            format=format).to_frame().equals(data_frame(10, 10))
+
+
+def keyfamily():
+    return pysdmx.Keyfamily(pysdmx.parse_xml(benchmark.keyfamily_message(10)))
+
+
+def test_key_expression():
+    # dimensions in DSD order whatever the order given, codes joined by
+    # + and any code for a dimension left out, None or '*'
+    key = pysdmx.KeyExpression(keyfamily(), CURRENCY=['C0001', 'C0002'],
+            CURRENCY_DENOM='*', FREQ='D')
+    assert str(key) == 'D.C0001+C0002.'
+    assert key.params() == [('FREQ', 'D'), ('CURRENCY', 'C0001+C0002')]
+    assert str(pysdmx.KeyExpression(keyfamily(), FREQ=None,
+        CURRENCY='C0001+C/2')) == '.C0001+C%2F2.'
+    with pytest.raises(ValueError):
+        pysdmx.KeyExpression(keyfamily(), COUNTRY='DE')
+
+
+def test_key_expression_validation():
+    key = pysdmx.KeyExpression(keyfamily(), FREQ='M', CURRENCY='C0001+XXX')
+    assert key.invalid() == {'CURRENCY': ['XXX']}
+    with pytest.raises(ValueError):
+        key.validate()
+    key = pysdmx.KeyExpression(keyfamily(), FREQ='M', CURRENCY='C0001')
+    assert key.validate() is key
+
+
+def test_data_query(server):
+    client = pysdmx.SDMX_REST(server.url, 'ECB')
+    data = client.data_query('EXR', startperiod='2000', FREQ='M',
+            CURRENCY=['C0001', 'C0002'])
+    assert server.paths == ['/KeyFamily/EXR', '/GenericData?dataflow=EXR'
+            '&FREQ=M&CURRENCY=C0001%2BC0002&startTime=2000']
+    assert data.to_frame().equals(data_frame(10, 10))
+    # invalid codes are caught before anything is sent
+    with pytest.raises(ValueError):
+        client.data_query('EXR', CURRENCY='XXX')
+    assert len(server.paths) == 2
+
+
+@pytest.mark.parametrize('format', ['csv', 'json'])
+def test_media_not_offered_falls_back_to_xml(server, format):
+    client = pysdmx.SDMX_REST(server.url, 'ECB', formats=('generic',))
+    assert client.data_extraction('EXR', None, None,
+            format=format).to_frame().equals(data_frame(10, 10))
+    with pytest.raises(ValueError):
+        client.data_extraction('EXR', None, None, format='compact')
+    assert server.paths == ['/GenericData?dataflow=EXR']
+
+
+def test_result_cache_single_flight():
+    # threads asking for a result being computed wait for it
+    cache = pysdmx.ResultCache()
+    stats = pysdmx.Stats()
+    release = threading.Event()
+    computed = []
+
+    def compute():
+        computed.append(1)
+        release.wait(10)
+        return object()
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(cache.get, 'key', 'KeyFamily', compute,
+            stats) for _ in range(8)]
+        deadline = time.monotonic() + 10
+        while stats.counts['result_coalesced'] < 7 \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(computed) == 1
+    assert all(result is results[0] for result in results)
+    assert cache.get('key', 'KeyFamily', object) is results[0]
+    assert stats.counts['result_misses'] == 1
+
+
+def test_result_cache_failure_is_not_stored():
+    cache = pysdmx.ResultCache()
+
+    def compute():
+        raise ValueError("refused")
+
+    with pytest.raises(ValueError):
+        cache.get('key', 'KeyFamily', compute)
+    assert cache.get('key', 'KeyFamily', lambda: 'value') == 'value'
+
+
+def test_result_cache_expiry_and_eviction():
+    cache = pysdmx.ResultCache(ttl={'Dataflow': 0})
+    first = cache.get('key', 'Dataflow', object)
+    assert cache.get('key', 'Dataflow', object) is not first
+    first = cache.get('key', 'KeyFamily', object)
+    assert cache.get('key', 'KeyFamily', object) is first
+    # results over max_size push out the least recently used
+    cache = pysdmx.ResultCache(max_size=3 * sys.getsizeof(object()))
+    values = [cache.get(key, 'KeyFamily', object) for key in range(4)]
+    assert cache.get(0, 'KeyFamily', object) is not values[0]
+    assert cache.get(3, 'KeyFamily', object) is values[3]
+
+
+def streamed(server):
+    # a client keeping the streamed bodies it hands to Data
+    client = pysdmx.SDMX_REST(server.url, 'ECB')
+    bodies = []
+    query = client._query
+
+    def _query(url, stream=False, resource=None):
+        bodies.append(query(url, stream=stream, resource=resource))
+        return bodies[-1]
+
+    client._query = _query
+    return client, bodies
+
+
+def test_stream_reads_like_tree(server):
+    client, bodies = streamed(server)
+    expected = pysdmx.Data(pysdmx.parse_xml(
+        server.messages['GenericData'])).to_frame()
+    data = client.data_extraction('EXR', None, None, stream=True)
+    assert not bodies[0].closed
+    assert data.to_frame().equals(expected)
+    assert bodies[0].closed
+    with pytest.raises(ValueError):
+        next(data.iter_series())
+
+
+def test_stream_read_halfway_is_closed():
+    # a body far longer than what iterparse reads at once
+    with benchmark.StandInServer(series=2000, observations=10,
+            structures=10) as server:
+        client, bodies = streamed(server)
+        series = client.data_extraction('EXR', None, None,
+                stream=True).iter_series()
+        next(series)
+        assert not bodies[0].closed
+        series.close()
+        assert bodies[0].closed
+
+
+def test_merge_overlapping_parts():
+    # every series of the shorter parts repeats periods of the longer one
+    merged = pysdmx.Data.merge([data(observations=5), data(observations=8),
+        data(observations=3), data(observations=8)])
+    assert merged.to_frame().equals(data(observations=8).to_frame())
+
+
+def test_merge_identical_parts():
+    merged = pysdmx.Data.merge([data(), data(), data()])
+    assert merged.to_frame().equals(data().to_frame())
+
+
+def test_split_refused_chunk_fails_once(server):
+    # a 404 is not worth splitting, nor a reason to shrink the window
+    client = pysdmx.SDMX_REST(server.url + '/missing', 'ECB')
+    planner = pysdmx.QueryPlanner()
+    data = client.data_extraction_split('EXR', 'M',
+            ['USD', 'JPY', 'GBP', 'CHF'], '2001', '2001', planner=planner)
+    assert server.requests == 1
+    assert len(data.failed) == 1
+    assert data.failed[0][-1].status_code == 404
+    assert planner.window == 365
+
+
+def test_refresh_fetches_new_codes_whole(tmp_path):
+    store = pysdmx.SeriesStore(str(tmp_path))
+    client = pysdmx.SDMX_REST('http://localhost', 'ECB')
+    store.update('EXR', data(series=1), datetime.datetime(2020, 1, 1),
+            FREQ='M', CURRENCY=['C0000'])
+    queries = []
+
+    def refresh_data(flowRef, freq, codes, startperiod=None,
+            endperiod=None, updatedafter=None):
+        queries.append((codes, updatedafter))
+        return data(series=2, observations=8)
+
+    client._refresh_data = refresh_data
+    stored = client.data_refresh(store, 'EXR', 'M', 'C0000+C0001')
+    assert queries == [(['C0001'], None),
+            (['C0000'], '2020-01-01T00:00:00Z')]
+    # other observation attributes than OBS_STATUS are not stored
+    assert stored.to_frame().equals(data(series=2,
+        observations=8).to_frame().drop(columns='OBS_CONF'))
+
+
+def test_refresh_sends_key_and_frequency(server, tmp_path):
+    store = pysdmx.SeriesStore(str(tmp_path))
+    client = pysdmx.SDMX_REST(server.url, 'ECB')
+    # the stand-in answers every query with C0000 to C0009, never C9999
+    client.data_refresh(store, 'EXR', 'M', 'C0000+C9999')
+    client.data_refresh(store, 'EXR', 'M', 'C0000+C9999')
+    client.data_refresh(store, 'EXR', 'M', 'C0000+C9999', mode='period')
+    queries = [urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+            for path in server.paths]
+    assert [query['FREQ'] for query in queries] == [['M']] * 3
+    assert [query['CURRENCY'] for query in queries] \
+            == [['C0000+C9999']] * 3
+    # C9999 is not fetched whole again
+    assert 'updatedAfter' not in queries[0]
+    assert 'updatedAfter' in queries[1]
+    assert 'startTime' in queries[2]
+
+
+def test_cache_body_cut_off_is_retried(server, tmp_path):
+    cache = pysdmx.HTTPCache(str(tmp_path))
+    server.cuts = 1
+    assert cache.fetch(server.url + '/KeyFamily', 'KeyFamily',
+            pysdmx.Transport(backoff=0.01)) == server.messages['KeyFamily']
+    assert server.requests == 2
+
+
+def test_body_cut_off_is_retried(server):
+    transport = pysdmx.Transport(backoff=0.01)
+    message = server.messages['GenericData']
+    server.cuts = 1
+    assert pysdmx.query_bytes(server.url + '/GenericData',
+            transport=transport) == message
+    server.cuts = 1
+    tree = pysdmx.query_rest(server.url + '/GenericData',
+            transport=transport)
+    assert pysdmx.Data(tree).to_frame().equals(pysdmx.Data(
+        pysdmx.parse_xml(message)).to_frame())
+    server.cuts = 1
+    _, content = pysdmx.query_media(server.url + '/GenericData', 'csv',
+            transport=transport)
+    assert content == server.media['text/csv']
+    assert server.requests == 6
+
+
+def test_cache_revalidates_and_misses_offline(server, tmp_path):
+    transport = pysdmx.Transport()
+    url = server.url + '/KeyFamily'
+    stats = pysdmx.Stats()
+    cache = pysdmx.HTTPCache(str(tmp_path), ttl={'KeyFamily': 0})
+    for _ in range(2):
+        assert cache.fetch(url, 'KeyFamily', transport, stats) \
+                == server.messages['KeyFamily']
+    assert stats.counts['cache_revalidated'] == 1
+    offline = pysdmx.HTTPCache(str(tmp_path), offline=True)
+    assert offline.fetch(url, 'KeyFamily', transport) \
+            == server.messages['KeyFamily']
+    with pytest.raises(ValueError):
+        offline.fetch(server.url + '/CodeList', 'CodeList', transport)
+    assert server.requests == 2
+
+
+def test_store_upsert_replaces_revised_periods(tmp_path):
+    store = pysdmx.SeriesStore(str(tmp_path))
+    store.update('EXR', data(observations=8), datetime.datetime(2020, 1, 1))
+    # the first 5 periods revised, the last 3 as stored
+    revised = pysdmx.Data(pysdmx.parse_xml(benchmark.generic_message(3,
+        5, 'M').replace(b'ObsValue value="1.', b'ObsValue value="2.')))
+    store.update('EXR', revised, datetime.datetime(2020, 2, 1))
+    frame = store.load('EXR').to_frame()
+    expected = data(observations=8).to_frame().drop(columns='OBS_CONF')
+    revisions = expected['TIME_PERIOD'] < '1900-06-01'
+    expected.loc[revisions, 'OBS_VALUE'] += 1
+    assert frame.equals(expected)
+
+
+def test_store_update_appends_changed_series_only(tmp_path):
+    store = pysdmx.SeriesStore(str(tmp_path))
+    store.update('EXR', data(observations=8), datetime.datetime(2020, 1, 1))
+    entries = json.loads(json.dumps(store.index['EXR']['series']))
+    revised = pysdmx.Data(pysdmx.parse_xml(benchmark.generic_message(1,
+        8, 'M').replace(b'ObsValue value="1.', b'ObsValue value="2.')))
+    store.update('EXR', revised, datetime.datetime(2020, 2, 1))
+    series = store.index['EXR']['series']
+    # the other series are where they were, the revised one appended
+    assert list(series) == ['M.C0001.EUR', 'M.C0002.EUR', 'M.C0000.EUR']
+    for name in ('M.C0001.EUR', 'M.C0002.EUR'):
+        assert dict(series[name], fetched=None) \
+                == dict(entries[name], fetched=None)
+    assert series['M.C0000.EUR']['offset'] == 24
+    assert (tmp_path / 'EXR' / 'values').stat().st_size == 32 * 8
+    expected = data(observations=8).to_frame().drop(columns='OBS_CONF')
+    expected.loc[expected['CURRENCY'] == 'C0000', 'OBS_VALUE'] += 1
+
+    def ordered(frame):
+        return frame.sort_values(['CURRENCY', 'TIME_PERIOD'],
+                ignore_index=True)
+
+    pandas.testing.assert_frame_equal(
+            ordered(store.load('EXR').to_frame()), ordered(expected),
+            check_categorical=False)
+    # observations sent again as they are stored are not written again
+    store.update('EXR', revised, datetime.datetime(2020, 3, 1))
+    assert (tmp_path / 'EXR' / 'values').stat().st_size == 32 * 8
+    assert list(series) == ['M.C0001.EUR', 'M.C0002.EUR', 'M.C0000.EUR']
+    # once most observations are left behind the columns are compacted
+    for changes in (data(series=1, observations=8), revised, revised,
+            data(series=1, observations=8)):
+        store.update('EXR', changes, datetime.datetime(2020, 4, 1))
+    assert sorted(path.name for path in (tmp_path / 'EXR').iterdir()) \
+            == ['dates.1', 'status.1', 'values.1']
+    assert (tmp_path / 'EXR' / 'values.1').stat().st_size == 24 * 8
+    pandas.testing.assert_frame_equal(
+            ordered(store.load('EXR').to_frame()),
+            ordered(data(observations=8).to_frame().drop(columns='OBS_CONF')),
+            check_categorical=False)
+    assert pysdmx.SeriesStore(str(tmp_path)).load('EXR').to_frame().equals(
+            store.load('EXR').to_frame())
+
+
+def test_store_load_keys_on_views(tmp_path):
+    store = pysdmx.SeriesStore(str(tmp_path))
+    store.update('EXR', data(series=4, observations=8),
+            datetime.datetime(2020, 1, 1))
+    expected = data(series=4, observations=8).to_frame().drop(
+            columns='OBS_CONF').set_index('CURRENCY', drop=False)
+    for keys, views in (
+            (['M.C0001.EUR', ('M', 'C0002', 'EUR')], True),
+            (['M.C0003.EUR', 'M.C0000.EUR'], False)):
+        loaded = store.load('EXR', keys)
+        # views on the read-only mapping of the columns, or a copy
+        assert loaded._values.flags.writeable != views
+        assert loaded._dates.flags.writeable != views
+        currencies = [key.split('.')[1] if isinstance(key, str) else key[1]
+                for key in keys]
+        pandas.testing.assert_frame_equal(loaded.to_frame(),
+                expected.loc[currencies].reset_index(drop=True),
+                check_categorical=False)
+
+
+def download(server, path, stats=None):
+    return pysdmx.download(server.url + '/GenericData', str(path),
+            transport=pysdmx.Transport(backoff=0.01), stats=stats)
+
+
+def test_download_resumes_cut_off_body(server, tmp_path):
+    stats = pysdmx.Stats()
+    server.cuts = 1
+    assert download(server, tmp_path / 'EXR.xml', stats)
+    assert stats.counts['download_resumes'] == 1
+    assert stats.counts['wire_bytes'] \
+            == len(server.compressed['GenericData'])
+    assert (tmp_path / 'EXR.xml').read_bytes() \
+            == server.compressed['GenericData']
+    assert sorted(path.name for path in tmp_path.iterdir()) \
+            == ['EXR.xml']
+
+
+def test_download_resumes_body_of_unknown_size(server, tmp_path):
+    # the first answer has no Content-Length, the 206 gives the total
+    server.chunked = True
+    server.cuts = 1
+    stats = pysdmx.Stats()
+    assert download(server, tmp_path / 'EXR.xml', stats)
+    assert server.requests == 2
+    assert stats.counts['download_resumes'] == 1
+    assert (tmp_path / 'EXR.xml').read_bytes() \
+            == server.compressed['GenericData']
+
+
+def part(server, path, content, total):
+    (path.parent / (path.name + '.part')).write_bytes(content)
+    (path.parent / (path.name + '.part.json')).write_text(json.dumps({
+        'url': server.url + '/GenericData', 'etag': None,
+        'last_modified': None, 'total': total, 'ranges': True}))
+
+
+def test_download_complete_part_answered_416(server, tmp_path):
+    body = server.compressed['GenericData']
+    part(server, tmp_path / 'EXR.xml', body, len(body))
+    assert download(server, tmp_path / 'EXR.xml')
+    assert server.requests == 1
+    assert (tmp_path / 'EXR.xml').read_bytes() == body
+
+
+def test_download_restarts_on_other_body(server, tmp_path):
+    body = server.compressed['GenericData']
+    # the part was of a larger body, the 206 gives another total
+    part(server, tmp_path / 'EXR.xml', body[:100], len(body) + 1)
+    stats = pysdmx.Stats()
+    assert download(server, tmp_path / 'EXR.xml', stats)
+    assert server.requests == 2
+    assert stats.counts['download_resumes'] == 0
+    assert (tmp_path / 'EXR.xml').read_bytes() == body
+    data = pysdmx.Data.from_file(str(tmp_path / 'EXR.xml'))
+    assert data.to_frame().equals(pysdmx.Data(pysdmx.parse_xml(
+        server.messages['GenericData'])).to_frame())